@@ -2,7 +2,7 @@ from flask import Flask, request, jsonify
 import logging
 import os
 
-import requests
+from team_index import TeamIndex, TeamDataError
 
 app = Flask(__name__)
 
@@ -12,6 +12,8 @@ GHOST_API_URL = f'http://{os.environ.get("GHOST_CONTAINER", None)}:5000'
 REGISTRY = os.environ.get('REGISTRY', None)
 TDA_ROUND = os.environ.get('TDA_ROUND', None)
 
+team_index = TeamIndex(GHOST_API_URL)
+
 
 @app.route('/', methods=['GET'])
 def home():
@@ -28,22 +30,12 @@ def staging_auth():
     if team_secret is None:
         return jsonify({"message": "team_secret is required"}), 400
 
-    team_data_response = requests.get(f"{GHOST_API_URL}/teams")
-    if team_data_response.status_code != 200:
-        return jsonify({"message": "Failed to get team data"}), 500
-
-    team_data = team_data_response.json()
-
-    # This code was copied, consider merging the basic_auth and ghost api
-    # but it is necessary to figure traefik middleware auth
-    if not all(isinstance(item, list) and len(item) == 4 and
-               all(isinstance(sub_item, str) for sub_item in item)
-               for item in team_data):
-        return jsonify({"message": "Received data in invalid format"}), 500
+    try:
+        team_id = team_index.get_team_id(team_secret)
+    except TeamDataError as e:
+        return jsonify({"message": str(e)}), 500
 
-    team_secrets = [team[2] for team in team_data]
-
-    if team_secret not in team_secrets:
+    if team_id is None:
         return jsonify({"message": "team_secret is invalid"}), 400
 
     registry_password = os.environ.get('REGISTRY_PASSWORD', None)
@@ -52,8 +44,6 @@ def staging_auth():
         logging.error("Registry password is not set")
         return jsonify({"message": "Registry password is not set"}), 500
 
-    team_id = team_data[team_secrets.index(team_secret)][1]
-
     return jsonify({"key": registry_password,
                     "name": f'{REGISTRY}/{TDA_ROUND}-team-{team_id}'}), 200
 
@@ -0,0 +1,156 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Maximum age (in seconds) of the index before it is revalidated against ghost_api
+TEAM_INDEX_TTL = float(os.environ.get('TEAM_INDEX_TTL', 30))
+TEAM_INDEX_TIMEOUT = float(os.environ.get('TEAM_INDEX_TIMEOUT', 10))
+# Time (in seconds) for which a secret unknown to ghost_api is not looked up again, and the maximum number of such
+# secrets remembered, so a client retrying a wrong secret does not send a request to ghost_api with every login
+TEAM_INDEX_MISS_TTL = float(os.environ.get('TEAM_INDEX_MISS_TTL', 5))
+TEAM_INDEX_MISS_CACHE_SIZE = int(os.environ.get('TEAM_INDEX_MISS_CACHE_SIZE', 10000))
+
+
+class TeamDataError(Exception):
+    pass
+
+
+class TeamIndex:
+    """
+    Index from team secrets to team IDs built from the team list of ghost_api, so a login is a dictionary lookup
+    instead of a download of the whole team list.
+
+    The index is refreshed once it is older than TEAM_INDEX_TTL, with the teams changed since the version of the last
+    refresh, so an unchanged team list costs an empty change list. Refreshes are single-flight: concurrent lookups wait
+    for the refresh started by the first of them instead of fetching the changes again. An unknown secret is looked up
+    in the secret index of ghost_api, so newly registered teams can log in before the index expires. A secret unknown
+    to ghost_api is not looked up again for TEAM_INDEX_MISS_TTL.
+    """
+
+    def __init__(self, ghost_api_url: str):
+        self.teams_url = f'{ghost_api_url}/teams'
+        self.by_secret_url = f'{ghost_api_url}/teams/by-secret'
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=10))
+        self._secrets: Dict[str, str] = {}
+        self._team_secrets: Dict[str, str] = {}
+        self._version: Optional[int] = None
+        self._fetched_at: Optional[float] = None
+        self._misses: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get_team_id(self, team_secret: str) -> Optional[str]:
+        """
+        Find the team with the given secret.
+
+        :param team_secret: The secret of the team.
+        :return: The ID of the team, or None if no team has the secret.
+        :raises TeamDataError: If the team list can not be fetched from ghost_api or is invalid.
+        """
+        self._refresh_if_older_than(TEAM_INDEX_TTL)
+        team_id = self._secrets.get(team_secret)
+        if team_id is None and not self._is_recent_miss(team_secret):
+            team_id = self._lookup(team_secret)
+        return team_id
+
+    def _lookup(self, team_secret: str) -> Optional[str]:
+        try:
+            response = self.session.get(f'{self.by_secret_url}/{quote(team_secret, safe="")}',
+                                        timeout=TEAM_INDEX_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Failed to get team data: {e}")
+            raise TeamDataError("Failed to get team data")
+
+        if response.status_code == 404:
+            with self._lock:
+                self._remember_miss(team_secret)
+            return None
+        if response.status_code != 200:
+            logging.error(f"Failed to get team data: status {response.status_code}")
+            raise TeamDataError("Failed to get team data")
+
+        team = response.json()
+        if not isinstance(team, list) or len(team) != 4 or not all(isinstance(item, str) for item in team):
+            raise TeamDataError("Received data in invalid format")
+        with self._lock:
+            self._apply([team], [], self._secrets, self._team_secrets)
+        return team[1]
+
+    def _is_recent_miss(self, team_secret: str) -> bool:
+        missed_at = self._misses.get(team_secret)
+        return missed_at is not None and time.monotonic() - missed_at < TEAM_INDEX_MISS_TTL
+
+    def _remember_miss(self, team_secret: str):
+        now = time.monotonic()
+        if len(self._misses) >= TEAM_INDEX_MISS_CACHE_SIZE:
+            self._misses = {secret: missed_at for secret, missed_at in self._misses.items()
+                            if now - missed_at < TEAM_INDEX_MISS_TTL}
+        # Once full of recent misses, further misses are not remembered, so the memory stays bounded
+        if len(self._misses) < TEAM_INDEX_MISS_CACHE_SIZE:
+            self._misses[team_secret] = now
+
+    def _refresh_if_older_than(self, max_age: float):
+        if self._is_younger_than(max_age):
+            return
+        with self._lock:
+            # The index may have been refreshed while waiting for the lock
+            if self._is_younger_than(max_age):
+                return
+            self._refresh()
+
+    def _is_younger_than(self, max_age: float) -> bool:
+        return self._fetched_at is not None and time.monotonic() - self._fetched_at < max_age
+
+    def _refresh(self):
+        try:
+            response = self.session.get(self.teams_url, params={'since': self._version or 0},
+                                        timeout=TEAM_INDEX_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Failed to get team data: {e}")
+            raise TeamDataError("Failed to get team data")
+
+        if response.status_code != 200:
+            logging.error(f"Failed to get team data: status {response.status_code}")
+            raise TeamDataError("Failed to get team data")
+
+        changes = response.json()
+
+        # This code was copied, consider merging the basic_auth and ghost api
+        # but it is necessary to figure traefik middleware auth
+        if not isinstance(changes, dict) or not isinstance(changes.get('version'), int) or \
+                not isinstance(changes.get('upserted'), list) or not isinstance(changes.get('deleted'), list) or \
+                not all(isinstance(item, list) and len(item) == 4 and
+                        all(isinstance(sub_item, str) for sub_item in item)
+                        for item in changes['upserted']) or \
+                not all(isinstance(item, str) for item in changes['deleted']):
+            raise TeamDataError("Received data in invalid format")
+
+        if changes.get('full'):
+            # Built aside, so concurrent lookups keep using the previous index
+            secrets, team_secrets = {}, {}
+            self._apply(changes['upserted'], [], secrets, team_secrets)
+            self._secrets, self._team_secrets = secrets, team_secrets
+        else:
+            self._apply(changes['upserted'], changes['deleted'], self._secrets, self._team_secrets)
+        self._version = changes['version']
+        self._fetched_at = time.monotonic()
+        if changes['upserted'] or changes['deleted']:
+            logging.info(f"Indexed {len(changes['upserted'])} changed and {len(changes['deleted'])} deleted teams, "
+                         f"{len(self._team_secrets)} teams in total")
+
+    @staticmethod
+    def _apply(team_data, deleted_team_ids, secrets: Dict[str, str], team_secrets: Dict[str, str]):
+        for team_id in deleted_team_ids + [team[1] for team in team_data]:
+            team_secret = team_secrets.pop(team_id, None)
+            if team_secret is not None and secrets.get(team_secret) == team_id:
+                del secrets[team_secret]
+        for _, team_id, team_secret, _ in team_data:
+            # The first team with the secret wins
+            secrets.setdefault(team_secret, team_id)
+            team_secrets[team_id] = team_secret
@@ -1,15 +1,20 @@
 from flask import Flask, jsonify, request, make_response, Response
 import logging
 import os
+import hashlib
 import json
-from typing import List, Tuple
+from typing import List, Tuple, Optional
 
-from persistance import get_team_data_from_db, persist_team_data, delete_all_data_from_db
+from persistance import get_team_data_from_db, persist_team_data, delete_all_data_from_db, get_data_version, \
+    get_team_by_secret, get_team_changes
 
 app = Flask(__name__)
 
 logging.basicConfig(level=logging.INFO)
 
+# (data version, serialized team list, ETag) of the last served team list
+teams_cache: Optional[Tuple[int, bytes, str]] = None
+
 
 @app.route('/', methods=['GET'])
 def home():
@@ -30,14 +35,84 @@ def home():
 
 @app.route('/teams', methods=['GET'])
 def get_teams():
-    team_data: List[Tuple[str, str, str, str]] = get_team_data_from_db()
-    team_data_json = json.dumps(team_data, ensure_ascii=False),
+    """
+    Return the list of all teams. The serialized list is cached per version of the team data, so it is only rebuilt
+    after the data changes and every other call costs a single Redis read of the version. The response carries an ETag,
+    and clients sending it back in If-None-Match get an empty 304 response while the data stays unchanged.
+
+    With the `since` query parameter, only the changes after the given version are returned, see get_team_changes.
+    """
+    if 'since' in request.args:
+        return get_team_changes_endpoint(request.args['since'])
+
+    body, etag = get_teams_body(get_data_version())
     response = Response(
-        response=team_data_json,
+        response=body,
+        status=200,
+        mimetype='application/json; charset=utf-8'
+    )
+    response.set_etag(etag)
+    # Clients may keep the response, but have to revalidate it on every use
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def get_teams_body(version: int) -> Tuple[bytes, str]:
+    global teams_cache
+    cache = teams_cache
+    if cache is not None and cache[0] == version:
+        return cache[1], cache[2]
+
+    team_data: List[Tuple[str, str, str, str]] = get_team_data_from_db()
+    body = json.dumps(team_data, ensure_ascii=False).encode('utf-8')
+    # The digest keeps the ETags distinct even if the version restarts after the database is flushed
+    etag = f'{version}-{hashlib.sha256(body).hexdigest()[:16]}'
+    teams_cache = (version, body, etag)
+    return body, etag
+
+
+def get_team_changes_endpoint(since):
+    """
+    Return the teams changed after the given version as an object with the current 'version', to be sent as `since`
+    by the next call, the changed teams in 'upserted' and the IDs of the deleted teams in 'deleted'. If the changes
+    since the version are not known, e.g. after all data was deleted, all teams are returned with 'full' set to true
+    and the caller has to replace its data.
+    """
+    try:
+        since = int(since)
+    except ValueError:
+        return jsonify({"message": "Invalid since version"}), 400
+    if since < 0:
+        return jsonify({"message": "Invalid since version"}), 400
+
+    changes = get_team_changes(since)
+    full = changes is None
+    if full:
+        # Read before the teams, so changes committed in the meantime are sent again by the next call
+        version = get_data_version()
+        changes = (version, get_team_data_from_db(), [])
+    version, team_data, deleted = changes
+    body = {"version": version, "full": full, "upserted": team_data, "deleted": deleted}
+    return Response(
+        response=json.dumps(body, ensure_ascii=False),
+        status=200,
+        mimetype='application/json; charset=utf-8'
+    )
+
+
+@app.route('/teams/by-secret/<string:team_hash>', methods=['GET'])
+def get_team_by_secret_endpoint(team_hash):
+    """
+    Return the team with the given secret hash, looked up in the secret index with a single Redis read.
+    """
+    team = get_team_by_secret(team_hash)
+    if team is None:
+        return jsonify({"message": "No team with the given secret"}), 404
+    return Response(
+        response=json.dumps(team, ensure_ascii=False),
         status=200,
         mimetype='application/json; charset=utf-8'
     )
-    return response
 
 
 @app.route('/teams', methods=['POST'])
@@ -56,9 +131,35 @@ def upload_teams():
                for item in team_data):
         return jsonify({"message": "Invalid format"}), 400
 
-    persist_team_data(team_data)
+    counts = persist_team_data(team_data)
+
+    return jsonify({"message": "Teams uploaded", **counts}), 200
+
+
+@app.route('/teams', methods=['PATCH'])
+def patch_teams():
+    """
+    Apply a batch of changes to the teams. The payload is an object with the teams to insert or update in 'upsert', in
+    the format of POST /teams, and the IDs of the teams to delete in 'delete'. Both are applied in one transaction.
+    """
+    payload = request.json
+    if not payload:
+        return jsonify({"message": "Missing payload"}), 400
+    if not isinstance(payload, dict):
+        return jsonify({"message": "Invalid format"}), 400
+
+    team_data = payload.get('upsert', [])
+    deleted_team_ids = payload.get('delete', [])
+    if not isinstance(team_data, list) or not all(isinstance(item, list) and len(item) == 4 and
+                                                  all(isinstance(sub_item, str) for sub_item in item)
+                                                  for item in team_data):
+        return jsonify({"message": "Invalid format"}), 400
+    if not isinstance(deleted_team_ids, list) or not all(isinstance(item, str) for item in deleted_team_ids):
+        return jsonify({"message": "Invalid format"}), 400
+
+    counts = persist_team_data(team_data, deleted_team_ids)
 
-    return jsonify({"message": "Teams uploaded"}), 200
+    return jsonify({"message": "Teams updated", **counts}), 200
 
 
 @app.route('/teams', methods=['DELETE'])
@@ -1,41 +1,236 @@
-from typing import List, Tuple, Set
+from typing import Dict, Iterable, List, Optional, Tuple, Set
+import json
 import os
 import redis
 
 redis_host = os.getenv('REDIS_HOST', 'redis-db')
 redis_port = int(os.getenv('REDIS_PORT', 6379))
 
+# Number of keys requested from Redis by every SCAN call
+scan_batch_size = int(os.getenv('SCAN_BATCH_SIZE', 1000))
+# Number of teams read in a single pipeline when comparing an upload with the stored data
+upload_batch_size = int(os.getenv('UPLOAD_BATCH_SIZE', 1000))
+upload_max_attempts = int(os.getenv('UPLOAD_MAX_ATTEMPTS', 5))
+
+team_fields = ('url', 'hash', 'team_name')
+
+# Version of the team data, bumped on every change. It is a string key, so it is not scanned as a team hash
+data_version_key = 'teams_version'
+# Secondary index from the team secrets to the serialized team rows. Its keys are strings, so they are not scanned as
+# team hashes
+secret_index_prefix = 'team_secret:'
+# Change log, a sorted set of the IDs of the inserted, updated and deleted teams scored by the version of their last
+# change. The changes after a version can be read from the log if the version is not older than the start key
+changes_key = 'teams_changes'
+changes_start_key = 'teams_changes_start'
+
 redis_db = redis.Redis(host=redis_host, port=redis_port, db=0, charset="utf-8", decode_responses=True)
 
 
+def get_data_version() -> int:
+    """
+    Read the version of the team data. The version increases monotonically with every change of the data.
+
+    :return: The current version, 0 if the data was never changed.
+    """
+    return int(redis_db.get(data_version_key) or 0)
+
+
+def get_team_by_secret(hash_value: str) -> Optional[Tuple[str, str, str, str]]:
+    """
+    Find the team with the given secret hash with a single key read from the secret index.
+
+    :param hash_value: The secret hash of the team.
+    :return: The (url, team_id, hash, team_name) tuple of the team, or None if no team has the hash.
+    """
+    row = redis_db.get(f'{secret_index_prefix}{hash_value}')
+    return tuple(json.loads(row)) if row else None
+
+
+def get_team_changes(since: int) -> Optional[Tuple[int, List[Tuple[str, str, str, str]], List[str]]]:
+    """
+    Read the teams inserted, updated or deleted after the given version from the change log. The IDs of the changed
+    teams are taken from the log together with the current version and the fields of the teams are fetched with
+    pipelined HMGETs, so a change committed in the meantime may be returned again by the next call, but is never
+    missed.
+
+    :param since: The version the caller has seen, 0 for all teams.
+    :return: (version, changed teams as (url, team_id, hash, team_name) tuples, IDs of deleted teams), or None if the
+             log does not cover the changes after the version, e.g. after all data was deleted.
+    """
+    pipeline = redis_db.pipeline(transaction=True)
+    pipeline.get(data_version_key)
+    pipeline.get(changes_start_key)
+    pipeline.zrangebyscore(changes_key, f'({since}', '+inf')
+    version, start, team_ids = pipeline.execute()
+    version = int(version or 0)
+    if start is None or since < int(start) or since > version:
+        return None
+
+    team_data, deleted = [], []
+    for batch_start in range(0, len(team_ids), scan_batch_size):
+        batch = team_ids[batch_start:batch_start + scan_batch_size]
+        pipeline = redis_db.pipeline(transaction=False)
+        for team_id in batch:
+            pipeline.hmget(team_id, *team_fields)
+        for team_id, (url, hash_value, team_name) in zip(batch, pipeline.execute()):
+            if url is None and hash_value is None and team_name is None:
+                deleted.append(team_id)
+            else:
+                team_data.append((url, team_id, hash_value, team_name))
+    return version, team_data, deleted
+
+
 def get_team_data_from_db() -> List[Tuple[str, str, str, str]]:
-    # get the team data from database
+    """
+    Read the data of all teams from the database without blocking Redis. The team hashes are iterated with a cursor
+    based SCAN and the fields of every batch of teams are fetched with pipelined HMGETs. The SCAN for the next batch is
+    sent in the same pipeline, so reading N teams takes about N / SCAN_BATCH_SIZE + 1 round trips.
+
+    :return: List of (url, team_id, hash, team_name) tuples.
+    """
     team_data = []
-    for team_id in redis_db.keys():
-        url = redis_db.hget(team_id, 'url')
-        hash_value = redis_db.hget(team_id, 'hash')
-        team_name = redis_db.hget(team_id, 'team_name')
-        team_data.append((url, team_id, hash_value, team_name))
-    return team_data
+    seen_team_ids: Set[str] = set()
+    cursor, team_ids = redis_db.scan(0, count=scan_batch_size, _type='hash')
+    while True:
+        # SCAN may return a key more than once
+        team_ids = [team_id for team_id in team_ids if team_id not in seen_team_ids]
+        seen_team_ids.update(team_ids)
+
+        pipeline = redis_db.pipeline(transaction=False)
+        for team_id in team_ids:
+            pipeline.hmget(team_id, 'url', 'hash', 'team_name')
+        if cursor != 0:
+            pipeline.scan(cursor, count=scan_batch_size, _type='hash')
+        results = pipeline.execute()
+
+        for team_id, (url, hash_value, team_name) in zip(team_ids, results):
+            # The team was deleted after it was scanned
+            if url is None and hash_value is None and team_name is None:
+                continue
+            team_data.append((url, team_id, hash_value, team_name))
+
+        if cursor == 0:
+            return team_data
+        cursor, team_ids = results[-1]
+
+
+def persist_team_data(team_data: List[Tuple[str, str, str, str]],
+                      deleted_team_ids: Iterable[str] = ()) -> Dict[str, int]:
+    """
+    Save the uploaded team data to the database. The stored data of the uploaded teams is read in pipelined batches
+    and only new and changed teams are written, together with the bump of the data version, in a single MULTI/EXEC
+    transaction, so readers never see a partially written upload. The data version is watched while the upload is
+    compared, and the comparison is repeated if another change is committed in the meantime.
+    The secret index is updated in the same transaction: the entries of changed secrets are replaced and missing or
+    outdated entries of unchanged teams are rewritten, e.g. for data stored before the index existed.
+    Every inserted, updated and deleted team is recorded in the change log with the new data version.
+
+    :param team_data: List of (url, team_id, hash, team_name) tuples. For a team listed more than once, the last
+                      entry is saved.
+    :param deleted_team_ids: IDs of the teams to delete, together with their secret index entries. Unknown IDs and
+                             IDs of teams in the team data are ignored.
+    :return: The numbers of 'inserted', 'updated', 'unchanged' and 'deleted' teams.
+    """
+    teams = {team_id: (url, hash_value, team_name) for url, team_id, hash_value, team_name in team_data}
+    deleted_team_ids = [team_id for team_id in dict.fromkeys(deleted_team_ids) if team_id not in teams]
+
+    with redis_db.pipeline(transaction=True) as transaction:
+        for attempt in range(1, upload_max_attempts + 1):
+            try:
+                transaction.watch(data_version_key)
+                version = int(transaction.get(data_version_key) or 0)
+                log_started = transaction.exists(changes_start_key)
+                stored, indexed = _read_teams(teams)
+                deleted_hashes = _read_hashes(deleted_team_ids)
+
+                counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+                changes = {}
+                index_updates = {}
+                transaction.multi()
+                for team_id in deleted_team_ids:
+                    if deleted_hashes[team_id] is None:
+                        continue
+                    counts['deleted'] += 1
+                    changes[team_id] = version + 1
+                    transaction.delete(team_id, f'{secret_index_prefix}{deleted_hashes[team_id]}')
+                for team_id, values in teams.items():
+                    url, hash_value, team_name = values
+                    row = json.dumps([url, team_id, hash_value, team_name], ensure_ascii=False)
+                    if indexed[team_id] != row:
+                        index_updates[f'{secret_index_prefix}{hash_value}'] = row
 
+                    if stored[team_id] == values:
+                        counts['unchanged'] += 1
+                        continue
+                    counts['inserted' if stored[team_id] is None else 'updated'] += 1
+                    changes[team_id] = version + 1
+                    transaction.hset(team_id, mapping=dict(zip(team_fields, values)))
+                    if stored[team_id] is not None and stored[team_id][1] != hash_value:
+                        transaction.delete(f'{secret_index_prefix}{stored[team_id][1]}')
+                # Written after the deletions of the replaced secrets, which may be reused by other teams
+                if index_updates:
+                    transaction.mset(index_updates)
+                if changes:
+                    transaction.zadd(changes_key, changes)
+                    # Data stored before the log existed is not in it, so the log only covers the changes after this one
+                    if not log_started:
+                        transaction.set(changes_start_key, version + 1)
+                    transaction.incr(data_version_key)
+                transaction.execute()
+                return counts
+            except redis.WatchError:
+                if attempt == upload_max_attempts:
+                    raise
+                transaction.reset()
 
-def persist_team_data(team_data: List[Tuple[str, str, str, str]]):
-    # save the team data to database
-    for url, team_id, hash_value, team_name in team_data:
-        redis_db.hset(team_id, mapping={'url': url, 'hash': hash_value, 'team_name': team_name})
+
+def _read_teams(teams: Dict[str, Tuple[str, str, str]]) -> Tuple[Dict[str, Optional[Tuple[str, str, str]]],
+                                                                  Dict[str, Optional[str]]]:
+    # Reads the stored fields of the teams and the secret index entries of their uploaded hashes
+    team_ids = list(teams)
+    stored, indexed = {}, {}
+    for start in range(0, len(team_ids), upload_batch_size):
+        batch = team_ids[start:start + upload_batch_size]
+        pipeline = redis_db.pipeline(transaction=False)
+        for team_id in batch:
+            pipeline.hmget(team_id, *team_fields)
+            pipeline.get(f'{secret_index_prefix}{teams[team_id][1]}')
+        results = pipeline.execute()
+        for team_id, values, row in zip(batch, results[::2], results[1::2]):
+            stored[team_id] = None if all(value is None for value in values) else tuple(values)
+            indexed[team_id] = row
+    return stored, indexed
+
+
+def _read_hashes(team_ids: List[str]) -> Dict[str, Optional[str]]:
+    # Reads the stored secret hashes of the teams, None for unknown teams
+    hashes = {}
+    for start in range(0, len(team_ids), upload_batch_size):
+        batch = team_ids[start:start + upload_batch_size]
+        pipeline = redis_db.pipeline(transaction=False)
+        for team_id in batch:
+            pipeline.hget(team_id, 'hash')
+        hashes.update(zip(batch, pipeline.execute()))
+    return hashes
 
 
 def delete_all_data_from_db():
     """
-    Delete all keys and their associated values from the Redis database.
+    Delete all keys and their associated values from the Redis database, except for the data version, which is bumped
+    instead, so a version is never reused for different data. The change log is deleted too and restarts at the new
+    version, so readers of older versions are sent all teams again.
     """
     try:
-        # Fetch all keys from the Redis database
-        all_keys = redis_db.keys()
-
-        # Delete each key
-        for key in all_keys:
-            redis_db.delete(key)
+        # Iterate the keys with a cursor and unlink them in batches, so Redis is never blocked and frees the memory
+        # in the background
+        cursor = None
+        while cursor != 0:
+            cursor, keys = redis_db.scan(cursor or 0, count=scan_batch_size)
+            keys = [key for key in keys if key not in (data_version_key, changes_start_key)]
+            if keys:
+                redis_db.unlink(*keys)
+        redis_db.set(changes_start_key, redis_db.incr(data_version_key))
 
         print("All data deleted successfully.")
 
@@ -1,11 +1,16 @@
 import argparse
+import json
 import logging
 import os
 import time
 import requests
 
-from typing import Tuple, List, Set
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from typing import Tuple, List, Set, Optional, Iterable
+from urllib.parse import urljoin
 
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -19,6 +24,11 @@ from getpass import getpass
 container_driver = os.environ.get('SELENIUM_CONTAINER_NAME', None)
 project_id = os.environ.get('PROJECT_ID', None)
 credentials_from_env = (os.environ.get('GHOST_API_USER', None), os.environ.get('GHOST_API_PASSWORD', None))
+# Number of pages fetched at the same time by the HTTP session
+scrape_concurrency = int(os.environ.get('SCRAPE_CONCURRENCY', 8))
+scrape_timeout = float(os.environ.get('SCRAPE_TIMEOUT', 20))
+# Newest team link of every project seen by the last successful sync
+scrape_state_file = os.environ.get('SCRAPE_STATE_FILE', 'scrape_state.json')
 
 if container_driver is not None:
     options = Options()
@@ -29,23 +39,77 @@ else:
     driver = webdriver.Chrome()
 
 
-def scrape_new_teams_data(email, password, base_url, credentials=credentials_from_env):
+def scrape_new_teams_data(email, password, base_url, credentials=credentials_from_env, use_http_session=True,
+                          incremental=True, state_file=scrape_state_file):
     login(email, password)
 
     existing_team_data: List[Tuple[str, str, str, str]] = get_teams_from_server(base_url)
 
     saved_links = links_from_team_data(existing_team_data)
-    links = set(team_ids())
+    known_links, high_water_mark = None, None
+    if incremental:
+        known_links = saved_links
+        high_water_mark = load_high_water_mark(state_file)
+        # A mark the server does not know about, e.g. after the team data was deleted, would hide unsaved teams
+        if high_water_mark not in saved_links:
+            high_water_mark = None
+
+    if use_http_session:
+        session = session_from_driver()
+        ordered_links = fetch_team_ids(session, known_links, high_water_mark)
+    else:
+        ordered_links = team_ids(known_links, high_water_mark)
+    links = set(ordered_links)
 
     # make set difference between all_ids and saved_ids
     new_links = links - saved_links
-    new_team_data = get_team_data(new_links)
+    new_team_data = fetch_team_data(session, new_links) if use_http_session else get_team_data(new_links)
 
-    upload_teams_to_server(base_url, new_team_data, credentials)
+    uploaded = upload_teams_to_server(base_url, new_team_data, credentials)
+    # The mark only moves once the teams before it are saved, otherwise the next sync would stop before them
+    if uploaded and ordered_links:
+        save_high_water_mark(state_file, ordered_links[0])
 
     return new_team_data
 
 
+def load_high_water_mark(state_file: str) -> Optional[str]:
+    try:
+        with open(state_file) as file:
+            return json.load(file).get(str(project_id))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, AttributeError) as e:
+        logging.warning(f"Ignoring the scrape state in {state_file}: {e}")
+        return None
+
+
+def save_high_water_mark(state_file: str, link: str):
+    try:
+        with open(state_file) as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        state = {}
+    if not isinstance(state, dict):
+        state = {}
+    state[str(project_id)] = link
+
+    # Replaced at once, so an interrupted write does not lose the marks of other projects
+    temporary_file = f'{state_file}.tmp'
+    with open(temporary_file, 'w') as file:
+        json.dump(state, file)
+    os.replace(temporary_file, state_file)
+
+
+def reached_known_teams(page_links: Iterable[str], known_links: Optional[Set[str]],
+                        high_water_mark: Optional[str]) -> bool:
+    # The team list is sorted by id descending, so the teams on the following pages are older than this page
+    if known_links is None:
+        return False
+    page_links = list(page_links)
+    return bool(page_links) and (high_water_mark in page_links or all(link in known_links for link in page_links))
+
+
 def login(email, password):
     driver.get("https://ghost.scg.cz/login")
 
@@ -80,14 +144,18 @@ def is_logged_in():
     return driver.get_cookie('scg_session') is not None
 
 
-def team_ids():
+def team_list_url(page):
+    return (f"https://ghost.scg.cz/tournaments/teams?filterData[project_id][0]=project-{project_id}&"
+            f"page={page}&sortingBy=id&sortingDirection=desc")
+
+
+def team_ids(known_links: Optional[Set[str]] = None, high_water_mark: Optional[str] = None):
+    # With known_links, paging stops after the first page with the high water mark or with only known links
     id_links = []
     page = 1
 
     while True:
-        url = (f"https://ghost.scg.cz/tournaments/teams?filterData[project_id][0]=project-{project_id}&"
-               f"page={page}&sortingBy=id&sortingDirection=desc")
-        driver.get(url)
+        driver.get(team_list_url(page))
 
         # Wait for the table to load
         WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.XPATH, "//table[@class='table']")))
@@ -99,6 +167,7 @@ def team_ids():
             print("No more rows found. Exiting.")
             break
 
+        page_links = []
         # Loop through each row to get the link in the "ID" column
         for row in rows:
             try:
@@ -109,11 +178,16 @@ def team_ids():
                 link = link_element.get_attribute("href")
 
                 # Append the link to the list
-                id_links.append(link)
+                page_links.append(link)
 
             except Exception as e:
                 print(f"An exception occurred: {e}")
 
+        id_links.extend(page_links)
+        if reached_known_teams(page_links, known_links, high_water_mark):
+            logging.info(f"Page {page} only lists known teams, stopping")
+            break
+
         # Check if the "Next" button is disabled
         next_button_disabled = driver.find_elements(By.XPATH, "//li[@aria-label='další »'][@aria-disabled='true']")
 
@@ -143,6 +217,145 @@ def get_team_data(id_links):
     return team_data
 
 
+def session_from_driver() -> requests.Session:
+    # Continue the session of the logged in browser with a pooled HTTP client
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=scrape_concurrency)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['User-Agent'] = driver.execute_script("return navigator.userAgent")
+    for cookie in driver.get_cookies():
+        session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain'), path=cookie.get('path', '/'))
+    return session
+
+
+class TableParser(HTMLParser):
+    """
+    Collects the first table with the class 'table' of a page: the text of every row with the cells separated by
+    spaces, like the text of the table in the browser, and the link in the first cell of every row.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.found = False
+        self.rows: List[List[str]] = []
+        self.first_cell_links: List[Optional[str]] = []
+        self.next_page_disabled = False
+        self._depth = 0
+        self._cell = 0
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'li' and attrs.get('aria-label') == 'další »' and attrs.get('aria-disabled') == 'true':
+            self.next_page_disabled = True
+        if self._depth:
+            if tag == 'table':
+                self._depth += 1
+            elif tag == 'tr' and self._depth == 1:
+                self.rows.append([])
+                self.first_cell_links.append(None)
+                self._cell = 0
+            elif tag in ('td', 'th') and self._depth == 1 and self.rows:
+                self._cell += 1
+                self.rows[-1].append(' ')
+            elif tag == 'br' and self.rows:
+                self.rows[-1].append('\n')
+            elif tag == 'a' and self._cell == 1 and self.first_cell_links and self.first_cell_links[-1] is None:
+                self.first_cell_links[-1] = attrs.get('href')
+        elif tag == 'table' and not self.found and attrs.get('class') == 'table':
+            self.found = True
+            self._depth = 1
+
+    def handle_endtag(self, tag):
+        if tag == 'table' and self._depth:
+            self._depth -= 1
+
+    def handle_data(self, data):
+        if self._depth and self.rows:
+            self.rows[-1].append(data)
+
+    def text(self) -> str:
+        lines = []
+        for row in self.rows:
+            for line in ''.join(row).split('\n'):
+                line = ' '.join(line.split())
+                if line:
+                    lines.append(line)
+        return '\n'.join(lines)
+
+
+def parse_table(html: str) -> TableParser:
+    parser = TableParser()
+    parser.feed(html)
+    parser.close()
+    return parser
+
+
+def fetch_page(session: requests.Session, url: str) -> Optional[TableParser]:
+    # None when the page has no table without JavaScript, e.g. after a redirect to the login
+    try:
+        response = session.get(url, timeout=scrape_timeout)
+    except requests.exceptions.RequestException as e:
+        logging.warning(f"Failed to fetch {url}: {e}")
+        return None
+    if response.status_code != 200:
+        logging.warning(f"Failed to fetch {url}: status {response.status_code}")
+        return None
+    page = parse_table(response.text)
+    return page if page.found else None
+
+
+def fetch_team_ids(session: requests.Session, known_links: Optional[Set[str]] = None,
+                   high_water_mark: Optional[str] = None) -> List[str]:
+    # Fetches the listing pages in rounds of scrape_concurrency pages until the last page is reached. In the
+    # incremental mode, with known_links, the rounds start with a single page and double, as a sync usually stops
+    # on the first pages
+    id_links = []
+    first_page = 1
+    round_size = 1 if known_links is not None else scrape_concurrency
+    with ThreadPoolExecutor(max_workers=scrape_concurrency) as executor:
+        while True:
+            numbers = range(first_page, first_page + round_size)
+            pages = list(executor.map(lambda number: fetch_page(session, team_list_url(number)), numbers))
+            for number, page in zip(numbers, pages):
+                if page is None:
+                    logging.warning(f"Page {number} of the team list could not be parsed, falling back to the browser")
+                    return team_ids(known_links, high_water_mark)
+
+                # Skipping the header row
+                links = [urljoin(team_list_url(number), link) for link in page.first_cell_links[1:] if link]
+                logging.info(f"Found {len(links)} rows on page {number}")
+                id_links.extend(links)
+                if len(page.rows) <= 1 or page.next_page_disabled:
+                    logging.info(f"Found {len(id_links)} teams")
+                    return id_links
+                if reached_known_teams(links, known_links, high_water_mark):
+                    logging.info(f"Page {number} only lists known teams, stopping")
+                    return id_links
+            first_page += round_size
+            round_size = min(round_size * 2, scrape_concurrency)
+
+
+def fetch_team_data(session: requests.Session, id_links) -> List[Tuple[str, str, str, str]]:
+    id_links = list(id_links)
+    with ThreadPoolExecutor(max_workers=scrape_concurrency) as executor:
+        pages = list(executor.map(lambda link: fetch_page(session, link), id_links))
+
+    team_data = []
+    browser_links = []
+    for link, page in zip(id_links, pages):
+        team_id, team_hash, team_name = extract_id_and_hash(page.text()) if page is not None else (None, None, None)
+        if team_id is None or team_hash is None:
+            browser_links.append(link)
+            continue
+        team_data.append((link, team_id, team_hash, team_name))
+
+    if browser_links:
+        logging.info(f"Loading {len(browser_links)} team pages in the browser")
+        team_data.extend(get_team_data(browser_links))
+    return team_data
+
+
 def extract_id_and_hash(text) -> Tuple[str, str, str]:
     lines = text.split('\n')
     id_value = None
@@ -194,6 +407,12 @@ if __name__ == "__main__":
     parser.add_argument("--project", required=True, help="ID of the project.")
     parser.add_argument("--ghost_user", required=True, help="Username for the ghost api service")
     parser.add_argument("--ghost_password", required=True, help="Password for the ghost api service")
+    parser.add_argument("--full", action="store_true",
+                        help="Page through the whole team list instead of stopping at the already saved teams")
+    parser.add_argument("--state_file", default=scrape_state_file,
+                        help="File keeping the newest team link seen by the last sync of every project")
+    parser.add_argument("--browser_only", action="store_true",
+                        help="Load every page in the browser instead of fetching the pages concurrently over HTTP")
 
     args = parser.parse_args()
 
@@ -201,5 +420,7 @@ if __name__ == "__main__":
     password = getpass("Enter your password: ")
 
     new_team_data = scrape_new_teams_data(args.email, password, args.base_url,
-                                          credentials=(args.ghost_user, args.ghost_password))
+                                          credentials=(args.ghost_user, args.ghost_password),
+                                          use_http_session=not args.browser_only, incremental=not args.full,
+                                          state_file=args.state_file)
     print(f"Newly scraped team data: {new_team_data}")
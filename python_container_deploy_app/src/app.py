@@ -1,20 +1,35 @@
+import json
 import os
-from flask import Flask, request, jsonify
+import uuid
+from flask import Flask, request, jsonify, Response
 from tasks.run_tasks import deploy_application as deploy_application_task
+from tasks.run_tasks import supersede_deploy_jobs
 from tasks.delete_tasks import delete_application as delete_application_task
 from tasks.delete_tasks import delete_all_applications as delete_all_applications_task
+from tasks.delete_tasks import delete_all_timeout
 from tasks.start_tasks import resume_stopped_containers as resume_stopped_containers_task
+from tasks.callback import notify_callback_url, notify_callback_url_on_failure
 from shared.persistance.applications import get_application
-from shared.persistance.applications import get_applications
+from shared.persistance.applications import list_applications
 from shared.persistance.applications import reset_redis
-from shared.persistance.redis_persistance import redis_queue
+from shared.persistance.applications import get_deploy_timings
+from shared.persistance.redis_persistance import redis_queue, InternalRedisError
 from shared.utils import get_log_level, get_image_name
+from shared.metrics import build_registry, QueueDepthCollector
+from shared.queues import interactive_queue_name, bulk_queue_name, maintenance_queue_name
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from rq import Queue
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
 
 import logging
 
 app = Flask(__name__)
-queue = Queue('default', connection=redis_queue)
+# Single-team deployments are kept apart from the bulk and maintenance operations, so workers can prioritize them
+interactive_queue = Queue(interactive_queue_name, connection=redis_queue)
+bulk_queue = Queue(bulk_queue_name, connection=redis_queue)
+maintenance_queue = Queue(maintenance_queue_name, connection=redis_queue)
+metrics_registry = build_registry(QueueDepthCollector(redis_queue))
 logging.basicConfig(level=get_log_level())
 
 
@@ -69,20 +84,134 @@ def deploy_application_endpoint(team_id):
     image_name = request.args.get('image-name', get_image_name(team_id))
     redeploy = request.args.get('redeploy', 'true').lower() in ['true', '1', 'yes']
     callback_url = request.args.get('callback-url', None)
+    readiness_probe = request.args.get('readiness-probe', None)
+    if readiness_probe is not None:
+        readiness_probe = readiness_probe.lower() in ['true', '1', 'yes']
 
-    # Enqueue the function call
-    job = queue.enqueue_call(func=deploy_application_task,
-                             args=(team_id, subdomain, image_name, registry_credentials, redeploy))
+    # Coalesce with the deployments of the team still waiting in the queue
+    job_id = str(uuid.uuid4())
+    try:
+        supersede_deploy_jobs({team_id: job_id})
+    except InternalRedisError as e:
+        return jsonify({"message": str(e)}), 500
 
-    # Enqueue the callback
-    if callback_url is not None:
-        job.callback = 'notify_callback_url'
-        job.meta['callback_url'] = callback_url
-        job.save_meta()
+    # Enqueue the function call
+    job = interactive_queue.enqueue_call(func=deploy_application_task,
+                                         args=(team_id, subdomain, image_name, registry_credentials, redeploy,
+                                               readiness_probe),
+                                         job_id=job_id, **_callback_options(callback_url))
 
     return jsonify({"message": "Deployment started", "job_id": job.get_id()}), 202
 
 
+@app.route('/applications', methods=['POST'])
+def deploy_applications_endpoint():
+    """
+    Initiates the deployment of multiple applications at once. The request body is a JSON array of deploy
+    specifications, each with the same options as the single deploy endpoint: 'team_id' (required), 'subdomain',
+    'image_name', 'registry_credentials', 'redeploy', 'readiness_probe' and 'callback_url'. Every specification is validated on its own,
+    invalid ones are reported without failing the rest of the batch, and all valid deployments are enqueued in a
+    single Redis pipeline. Deployments of the same teams still waiting in the queues are superseded.
+
+    :return: JSON response with a result for every specification in the request order, containing either the job ID
+             or the validation error, along with an HTTP 202 status code if at least one deployment was enqueued,
+             or an HTTP 400 status code otherwise.
+    """
+    specs = request.get_json(silent=True)
+    if not isinstance(specs, list) or not specs:
+        return jsonify({"message": "Expected a non-empty JSON array of deploy specifications"}), 400
+
+    results = []
+    job_datas = []
+    seen_team_ids = set()
+    for index, spec in enumerate(specs):
+        deploy_args, callback_url, err = _parse_deploy_spec(spec)
+        if err is None and deploy_args[0] in seen_team_ids:
+            err = f"Duplicate deploy specification for team {deploy_args[0]}"
+        if err is not None:
+            results.append({"index": index, "team_id": spec.get('team_id') if isinstance(spec, dict) else None,
+                            "error": err})
+            continue
+
+        seen_team_ids.add(deploy_args[0])
+        job_id = str(uuid.uuid4())
+        job_datas.append(Queue.prepare_data(deploy_application_task, args=deploy_args, job_id=job_id,
+                                            **_callback_options(callback_url)))
+        results.append({"index": index, "team_id": deploy_args[0], "job_id": job_id})
+
+    if not job_datas:
+        return jsonify({"message": "No valid deploy specification", "results": results}), 400
+
+    try:
+        supersede_deploy_jobs({result["team_id"]: result["job_id"] for result in results if "error" not in result})
+    except InternalRedisError as e:
+        return jsonify({"message": str(e)}), 500
+
+    with redis_queue.pipeline() as pipeline:
+        jobs = bulk_queue.enqueue_many(job_datas, pipeline=pipeline)
+        pipeline.execute()
+
+    return jsonify({"message": f"Deployment of {len(jobs)} applications started", "results": results}), 202
+
+
+def _parse_deploy_spec(spec):
+    """
+    Validates a single deploy specification of the bulk deploy endpoint and converts it to the arguments of the
+    deploy task, applying the same defaults as the single deploy endpoint.
+
+    :param spec: The deploy specification as decoded from the request body.
+    :return: Tuple (tuple or None, str or None, str or None). The deploy task arguments, the callback URL and an error
+             message if the specification is invalid.
+    """
+    if not isinstance(spec, dict):
+        return None, None, "Deploy specification must be an object"
+
+    team_id = spec.get('team_id')
+    if not isinstance(team_id, str) or not team_id:
+        return None, None, "team_id must be a non-empty string"
+
+    subdomain = spec.get('subdomain', team_id)
+    image_name = spec.get('image_name', get_image_name(team_id))
+    registry_credentials = spec.get('registry_credentials')
+    callback_url = spec.get('callback_url')
+    redeploy = spec.get('redeploy', True)
+    readiness_probe = spec.get('readiness_probe')
+
+    for name, value in (('subdomain', subdomain), ('image_name', image_name)):
+        if not isinstance(value, str) or not value:
+            return None, None, f"{name} must be a non-empty string"
+    for name, value in (('registry_credentials', registry_credentials), ('callback_url', callback_url)):
+        if value is not None and not isinstance(value, str):
+            return None, None, f"{name} must be a string"
+    if registry_credentials is not None and ':' not in registry_credentials:
+        return None, None, "registry_credentials must be in the 'username:password' format"
+    if isinstance(redeploy, str):
+        redeploy = redeploy.lower() in ['true', '1', 'yes']
+    elif not isinstance(redeploy, bool):
+        return None, None, "redeploy must be a boolean"
+    if isinstance(readiness_probe, str):
+        readiness_probe = readiness_probe.lower() in ['true', '1', 'yes']
+    elif readiness_probe is not None and not isinstance(readiness_probe, bool):
+        return None, None, "readiness_probe must be a boolean"
+
+    return (team_id, subdomain, image_name, registry_credentials, redeploy, readiness_probe), callback_url, None
+
+
+def _callback_options(callback_url):
+    """
+    Builds the enqueue options notifying the callback URL once the job finishes or fails. The notification is queued
+    by the worker and delivered by the callback dispatcher.
+
+    :param callback_url: str or None. The URL to notify, or None if no notification is requested.
+    :return: dict. The keyword arguments for enqueueing the job.
+    """
+    if callback_url is None:
+        return {}
+    return {'meta': {'callback_url': callback_url},
+            'on_success': notify_callback_url,
+            'on_failure': notify_callback_url_on_failure}
+
+
 @app.route('/application', methods=['PUT'])
 def restart_all_applications_endpoint():
     """
@@ -95,13 +224,7 @@ def restart_all_applications_endpoint():
     callback_url = request.args.get('callback-url', None)
 
     # Enqueue the function call
-    job = queue.enqueue_call(func=resume_stopped_containers_task)
-
-    # Enqueue the callback
-    if callback_url is not None:
-        job.callback = 'notify_callback_url'
-        job.meta['callback_url'] = callback_url
-        job.save_meta()
+    job = bulk_queue.enqueue_call(func=resume_stopped_containers_task, **_callback_options(callback_url))
 
     return jsonify({"message": "Restart of all aplications started", "job_id": job.get_id()}), 202
 
@@ -109,12 +232,74 @@ def restart_all_applications_endpoint():
 @app.route('/application', methods=['GET'])
 def get_all_applications_endpoint():
     """
-    Retrieves data for all applications stored in Redis.
+    Retrieves data for the applications stored in Redis. The JSON array is streamed while the applications are read
+    from Redis. The query parameters `fields`, `status` and `team_id` take comma separated lists: the listed fields
+    (all except the logs by default) and the statuses and team IDs the applications are filtered by. With `cursor` or
+    `limit`, a single page is returned and the cursor of the next page is sent in the X-Next-Cursor header, 0 after
+    the last page.
+
+    :return: Streamed JSON response containing an array of application data, or JSON response with an error message,
+             and the corresponding HTTP status code.
+    """
+    try:
+        cursor = _int_arg('cursor', minimum=0)
+        limit = _int_arg('limit', minimum=1, maximum=1000)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    result, status = list_applications(cursor=cursor, limit=limit, fields=_list_arg('fields'),
+                                       statuses=_list_arg('status'), team_ids=_list_arg('team_id'))
+    if status != 200:
+        return jsonify({"message": result}), status
+
+    next_cursor, applications = result
+    response = Response(_stream_json_array(applications), status=200, mimetype='application/json')
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+
+def _int_arg(name, minimum, maximum=None):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if not value.isdigit() or int(value) < minimum or (maximum is not None and int(value) > maximum):
+        raise ValueError(f'Invalid {name}: {value}')
+    return int(value)
+
+
+def _list_arg(name):
+    # Accepts both comma separated and repeated parameters
+    values = request.args.getlist(name)
+    if not values:
+        return None
+    return [item for value in values for item in value.split(',') if item]
+
+
+def _stream_json_array(items):
+    yield '['
+    try:
+        for index, item in enumerate(items):
+            yield (',' if index else '') + json.dumps(item)
+    except InternalRedisError:
+        # The response is already being sent, the client gets an incomplete JSON array
+        logging.error('Listing of the applications aborted')
+        return
+    yield ']'
+
+
+@app.route('/deploy-timings', methods=['GET'])
+def get_deploy_timings_endpoint():
+    """
+    Retrieves the percentiles of the durations of the deployment phases over the latest deployments.
 
-    :return: JSON response containing an array of application data and the corresponding HTTP status code.
+    :return: JSON response mapping the phase names to their duration summaries and the corresponding HTTP status code.
     """
-    applications, status = get_applications()
-    return jsonify(applications), status
+    result, status = get_deploy_timings()
+    if status == 200:
+        return jsonify(result), status
+    else:
+        return jsonify({"message": result}), status
 
 
 @app.route('/application/<string:team_id>', methods=['DELETE'])
@@ -138,20 +323,64 @@ def delete_application_endpoint(team_id):
 @app.route('/application', methods=['DELETE'])
 def delete_all_applications_endpoint():
     """
-    Deletes all applications if the appropriate flag is set. Supports a forced deletion mode via query parameters.
+    Deletes all applications if the appropriate flag is set. The deletion runs as a background job, whose progress
+    and result can be followed at the job endpoint. Supports a forced deletion mode, a custom grace period for
+    stopping the containers and a kill mode without any grace period via query parameters.
 
-    :return: JSON response with a list of deleted team IDs or an error message, along with the corresponding HTTP status code.
+    :return: JSON response with a message indicating that the deletion has started and the job ID, along with an HTTP
+             202 status code, or an error message with an HTTP 400 status code.
     """
     force = request.args.get('force', 'false').lower() in ['true', '1', 'yes']
+    kill = request.args.get('kill', 'false').lower() in ['true', '1', 'yes']
     delete_all = request.args.get('delete-all-applications', None)
+    callback_url = request.args.get('callback-url', None)
+    stop_timeout = request.args.get('stop-timeout', None)
+    if stop_timeout is not None:
+        if not stop_timeout.isdigit():
+            return jsonify({"message": "stop-timeout must be a non-negative integer"}), 400
+        stop_timeout = int(stop_timeout)
 
     # If delete_all is true, delete all applications
-    if delete_all and delete_all.lower() in ['true', '1', 'yes']:
-        deleted, err, status = delete_all_applications_task(force=force)
-        return jsonify({"deleted_ids": deleted}), 200
-    else:
+    if not delete_all or delete_all.lower() not in ['true', '1', 'yes']:
         return jsonify({"message": "Delete all flag not set"}), 400
 
+    job = maintenance_queue.enqueue_call(func=delete_all_applications_task,
+                                         kwargs={'force': force, 'stop_timeout': stop_timeout, 'kill': kill},
+                                         timeout=delete_all_timeout, **_callback_options(callback_url))
+
+    return jsonify({"message": "Deletion of all applications started", "job_id": job.get_id()}), 202
+
+
+@app.route('/job/<string:job_id>', methods=['GET'])
+def get_job_endpoint(job_id):
+    """
+    Retrieves the state of a background job, including the progress reported by long-running jobs and the result
+    of finished jobs.
+
+    :param job_id: Path parameter specifying the ID of the job.
+    :return: JSON response containing the job status, metadata and result with an HTTP 200 status,
+             or an error message with an HTTP 404 status code if the job does not exist.
+    """
+    try:
+        job = Job.fetch(job_id, connection=redis_queue)
+    except NoSuchJobError:
+        return jsonify({"message": f"No job found with ID {job_id}"}), 404
+
+    return jsonify({"job_id": job.get_id(),
+                    "status": job.get_status(),
+                    "meta": job.meta,
+                    "result": job.return_value()}), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Exposes the metrics of the API in the Prometheus text format, including the current depth of the RQ queues.
+
+    :return: The metrics in the Prometheus text format and an HTTP 200 status code.
+    """
+    return Response(generate_latest(metrics_registry), status=200, content_type=CONTENT_TYPE_LATEST)
+
 
 if __name__ == '__main__':
     debug_mode = os.environ.get('DEBUG_MODE', 'False').lower() == 'true'
@@ -0,0 +1,13 @@
+import logging
+import os
+
+# The dispatcher runs from the worker image, but does not expose the metrics shared by the worker processes
+os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+
+from shared.utils import get_log_level  # noqa: E402
+from tasks.callback_dispatcher import run_dispatcher  # noqa: E402
+
+
+logging.basicConfig(level=get_log_level())
+
+run_dispatcher()
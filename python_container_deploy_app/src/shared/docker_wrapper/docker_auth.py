@@ -0,0 +1,75 @@
+import hashlib
+import os
+import threading
+import time
+
+import docker
+import logging
+
+from shared.docker_wrapper.docker_client import get_client
+from shared.docker_wrapper.docker_utils import UnauthorizedError
+from shared.persistance.redis_persistance import get_registry_auth_fingerprint, save_registry_auth_fingerprint, \
+    InternalRedisError
+
+
+registry_auth_ttl = float(os.environ.get('REGISTRY_AUTH_TTL', 300))
+
+# (registry, username) -> (credentials fingerprint, expiration time)
+_auth_cache = {}
+_auth_cache_lock = threading.Lock()
+
+
+def get_registry_auth(registry, username, password):
+    """
+    Returns the auth config for pulling images from a registry with the given credentials. The credentials are
+    validated against the registry at most once per REGISTRY_AUTH_TTL seconds for every (registry, username) pair:
+    validated credentials are cached in the process and, as the RQ worker runs every job in a forked process, also
+    in Redis, so the other jobs and workers reuse them without logging in again. The returned auth config is meant to
+    be passed directly to the pull, the login state of the Docker clients used for the pulls is never changed.
+
+    :param registry: str. The address of the registry.
+    :param username: str. The name of the registry user.
+    :param password: str. The password of the registry user.
+
+    :return: dict. The auth config with the 'username', 'password' and 'serveraddress' keys.
+
+    :raises UnauthorizedError: If the registry rejects the credentials.
+
+    Note: Only a fingerprint of the credentials is cached, so changed credentials are always validated again. When
+    Redis is not reachable, the credentials are validated without the shared cache.
+    """
+    auth_config = {'username': username, 'password': password, 'serveraddress': registry}
+    fingerprint = hashlib.sha256(f'{registry}\0{username}\0{password}'.encode('utf-8')).hexdigest()
+    key = (registry, username)
+
+    with _auth_cache_lock:
+        cached = _auth_cache.get(key)
+    if cached and cached[0] == fingerprint and cached[1] > time.time():
+        logging.debug(f'Using cached credentials of user {username} for registry {registry}')
+        return auth_config
+
+    try:
+        shared_fingerprint = get_registry_auth_fingerprint(registry, username)
+    except InternalRedisError:
+        shared_fingerprint = None
+
+    if shared_fingerprint != fingerprint:
+        _validate_credentials(registry, username, password)
+        try:
+            save_registry_auth_fingerprint(registry, username, fingerprint, registry_auth_ttl)
+        except InternalRedisError:
+            logging.warning(f'Failed to share the validated credentials of user {username} for registry {registry}')
+
+    with _auth_cache_lock:
+        _auth_cache[key] = (fingerprint, time.time() + registry_auth_ttl)
+    return auth_config
+
+
+def _validate_credentials(registry, username, password):
+    try:
+        login_result = get_client('auth').login(username=username, password=password, registry=registry,
+                                                reauth=True)
+    except docker.errors.APIError as e:
+        logging.error(f'API error: {str(e)}')
+        raise UnauthorizedError("Invalid registry credentials")
+    logging.info(f'Logged in to registry {registry} with username {username} with result {login_result}')
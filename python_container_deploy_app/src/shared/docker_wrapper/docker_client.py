@@ -0,0 +1,53 @@
+import os
+import threading
+
+import docker
+
+from shared.metrics import observe_docker_call
+
+
+docker_pool_size = int(os.environ.get('DOCKER_POOL_SIZE', 16))
+
+# HTTP timeouts (in seconds) of the Docker API calls by the kind of operation. The stop timeout is extended by
+# the grace period given to the container by the Docker SDK itself.
+operation_timeouts = {
+    'default': float(os.environ.get('DOCKER_TIMEOUT', 60)),
+    'pull': float(os.environ.get('DOCKER_PULL_TIMEOUT', 600)),
+    'create': float(os.environ.get('DOCKER_CREATE_TIMEOUT', 60)),
+    'stop': float(os.environ.get('DOCKER_STOP_TIMEOUT', 30)),
+    'inspect': float(os.environ.get('DOCKER_INSPECT_TIMEOUT', 10)),
+    'auth': float(os.environ.get('DOCKER_TIMEOUT', 60)),
+}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(operation='default'):
+    """
+    Returns the shared Docker client for the given kind of operation. Every Docker call of the docker_wrapper modules
+    goes through this factory. The clients are constructed lazily on first use, one per kind of operation, so each of
+    them can have its own timeout, and they are shared by all threads of the process. Every client keeps a pool of
+    at most DOCKER_POOL_SIZE connections to the Docker daemon. The latency of the calls made by the clients is recorded
+    in the Docker call metrics by the kind of operation.
+
+    :param operation: str. The kind of operation the client is used for, one of 'default', 'pull', 'create', 'stop',
+                      'inspect' and 'auth'. The 'auth' client is only used for validating registry credentials, so its
+                      login state is never used by the other operations.
+
+    :return: docker.DockerClient. The client configured with the timeout of the operation.
+
+    :raises ValueError: If the kind of operation is unknown.
+    """
+    if operation not in operation_timeouts:
+        raise ValueError(f'Unknown Docker operation {operation}')
+
+    client = _clients.get(operation)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(operation)
+            if client is None:
+                client = docker.from_env(timeout=operation_timeouts[operation], max_pool_size=docker_pool_size)
+                client.api.hooks['response'].append(observe_docker_call(operation))
+                _clients[operation] = client
+    return client
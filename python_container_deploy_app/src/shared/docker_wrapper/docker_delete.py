@@ -1,24 +1,33 @@
+import os
+
 import docker
 import logging
 
+from shared.docker_wrapper.docker_client import get_client
 from shared.docker_wrapper.docker_utils import InternalDockerError
 
 
-client = docker.from_env()
+default_stop_timeout = int(os.environ.get('CONTAINER_STOP_TIMEOUT', 10))
 
 
-def delete_container(container_id):
+def delete_container(container_id, stop_timeout=None, kill=False):
     """
     Stop and remove a Docker container.
 
     :param container_id: The ID of the container to stop and remove
+    :param stop_timeout: The grace period (in seconds) given to the container to stop before it is killed,
+                         defaults to the CONTAINER_STOP_TIMEOUT environment variable
+    :param kill: If True, the container is killed and removed right away without any grace period
     :return: True if the container was stopped and removed, False if the container did not exist
     :raises InternalDockerError: If an error occurred while stopping or removing the container
     """
     try:
-        container = client.containers.get(container_id)
-        container.stop()
-        container.remove()
+        container = get_client('stop').containers.get(container_id)
+        if kill:
+            container.remove(force=True)
+        else:
+            container.stop(timeout=default_stop_timeout if stop_timeout is None else stop_timeout)
+            container.remove()
         msg = f'Stopped and removed container {container_id}\n'
         logging.info(msg)
         return True
@@ -0,0 +1,178 @@
+import os
+import time
+import uuid
+
+import docker
+import logging
+
+from shared.docker_wrapper.docker_client import get_client
+from shared.metrics import image_pull_seconds, image_pull_bytes
+from shared.persistance.redis_persistance import acquire_lease, release_lease, is_lease_held, InternalRedisError
+
+
+pull_lease_ttl = float(os.environ.get('IMAGE_PULL_LEASE_TTL', 300))
+pull_wait_interval = float(os.environ.get('IMAGE_PULL_WAIT_INTERVAL', 0.5))
+
+
+def pull_image(image_name, auth_config=None):
+    """
+    Makes sure the latest version of the given image is available on the Docker host, pulling it only when necessary.
+    The digest of the image manifest in the registry is checked first and the pull is skipped when the local image
+    already has the same digest. Concurrent pulls of the same image reference by several RQ workers are collapsed
+    into a single pull: the worker holding the Redis pull lease pulls the image, while the other workers wait for
+    the lease to be released and then reuse the pulled image, as all workers share the same Docker daemon. When the
+    registry digest can not be retrieved, the waiting workers reuse the local image if it exists.
+
+    :param image_name: str. The name of the image, optionally including the registry and the tag.
+    :param auth_config: dict, optional. Registry credentials with the 'username' and 'password' keys.
+
+    :return: bool. True if the image was pulled; False if the local image was already up to date.
+
+    :raises docker.errors.ImageNotFound: If the image does not exist in the registry.
+    :raises docker.errors.APIError: If the Docker daemon fails to pull the image.
+
+    Note: When Redis is not reachable, the function falls back to pulling the image without the cross-worker lease.
+    The duration of the call is recorded in the image pull metrics by its result.
+    """
+    start = time.monotonic()
+    result = 'failed'
+    try:
+        pulled = _pull_image(image_name, auth_config)
+        result = 'pulled' if pulled else 'skipped'
+        return pulled
+    finally:
+        image_pull_seconds.labels(result).observe(time.monotonic() - start)
+
+
+def _pull_image(image_name, auth_config=None):
+    reference = normalize_image_reference(image_name)
+    remote_digest = get_remote_digest(reference, auth_config)
+    if remote_digest and has_local_digest(reference, remote_digest):
+        logging.info(f'Image {reference} is up to date ({remote_digest}), skipping pull')
+        return False
+
+    lease_key = f'image_pull_lease:{reference}'
+    token = uuid.uuid4().hex
+    deadline = time.time() + pull_lease_ttl
+
+    try:
+        while not acquire_lease(lease_key, token, pull_lease_ttl):
+            logging.info(f'Image {reference} is being pulled by another worker, waiting')
+            while is_lease_held(lease_key) and time.time() < deadline:
+                time.sleep(pull_wait_interval)
+
+            if remote_digest and has_local_digest(reference, remote_digest):
+                logging.info(f'Image {reference} was pulled by another worker ({remote_digest})')
+                return False
+            if time.time() >= deadline:
+                logging.warning(f'Timed out waiting for the pull of image {reference}, pulling it directly')
+                _pull(reference, auth_config)
+                return True
+            if not remote_digest and has_local_image(reference):
+                logging.info(f'Image {reference} was pulled by another worker')
+                return False
+    except InternalRedisError:
+        logging.warning(f'Could not coordinate the pull of image {reference} through Redis, pulling it directly')
+        _pull(reference, auth_config)
+        return True
+
+    try:
+        _pull(reference, auth_config)
+        return True
+    finally:
+        try:
+            release_lease(lease_key, token)
+        except InternalRedisError:
+            logging.warning(f'Failed to release the pull lease of image {reference}, it will expire on its own')
+
+
+def _pull(reference, auth_config=None):
+    logging.info(f'Attempting to pull image: {reference}')
+    repository, tag = docker.utils.parse_repository_tag(reference)
+    layer_sizes = {}
+    for event in get_client('pull').api.pull(repository, tag=tag, stream=True, decode=True,
+                                             auth_config=auth_config):
+        if 'error' in event:
+            raise _pull_error(reference, event['error'])
+        if event.get('status') == 'Downloading' and (event.get('progressDetail') or {}).get('total'):
+            layer_sizes[event.get('id')] = event['progressDetail']['total']
+
+    pulled_bytes = sum(layer_sizes.values())
+    image_pull_bytes.inc(pulled_bytes)
+    logging.info(f'Pulled image {reference}, downloaded {pulled_bytes} bytes')
+
+
+def _pull_error(reference, message):
+    # Only a missing image is reported as such, other errors (e.g. denied access, rate limits or network errors)
+    # are failures of the pull
+    if 'manifest unknown' in message.lower() or 'not found' in message.lower():
+        return docker.errors.ImageNotFound(f'Failed to pull image {reference}: {message}')
+    return docker.errors.APIError(f'Failed to pull image {reference}: {message}')
+
+
+def get_remote_digest(image_name, auth_config=None):
+    """
+    Retrieves the digest of the image manifest from the registry without pulling the image.
+
+    :param image_name: str. The name of the image, including the tag.
+    :param auth_config: dict, optional. Registry credentials with the 'username' and 'password' keys.
+
+    :return: str or None. The manifest digest (e.g. 'sha256:...') or None if it could not be retrieved, in which case
+             the caller is expected to pull the image.
+    """
+    try:
+        return get_client('pull').images.get_registry_data(image_name, auth_config=auth_config).id
+    except docker.errors.APIError as e:
+        logging.info(f'Could not get the registry digest of image {image_name}: {str(e)}')
+        return None
+
+
+def has_local_image(image_name):
+    """
+    Checks whether an image with the given name exists on the Docker host.
+
+    :param image_name: str. The name of the image, including the tag.
+
+    :return: bool. True if the local image exists; False otherwise.
+    """
+    try:
+        get_client('inspect').images.get(image_name)
+    except docker.errors.ImageNotFound:
+        return False
+    except docker.errors.APIError as e:
+        logging.info(f'Could not inspect local image {image_name}: {str(e)}')
+        return False
+    return True
+
+
+def has_local_digest(image_name, digest):
+    """
+    Checks whether the local image with the given name was pulled from a manifest with the given digest.
+
+    :param image_name: str. The name of the image, including the tag.
+    :param digest: str. The manifest digest to look for.
+
+    :return: bool. True if the local image exists and matches the digest; False otherwise.
+    """
+    try:
+        image = get_client('inspect').images.get(image_name)
+    except docker.errors.ImageNotFound:
+        return False
+    except docker.errors.APIError as e:
+        logging.info(f'Could not inspect local image {image_name}: {str(e)}')
+        return False
+    return any(repo_digest.endswith(f'@{digest}') for repo_digest in image.attrs.get('RepoDigests') or [])
+
+
+def normalize_image_reference(image_name):
+    """
+    Adds the implicit 'latest' tag to an image name without a tag or digest, so the same image is always referred to
+    by the same string.
+
+    :param image_name: str. The name of the image, optionally including the registry and the tag.
+    :return: str. The image name including a tag or a digest.
+    """
+    repository, tag = docker.utils.parse_repository_tag(image_name)
+    if tag:
+        return image_name
+    return f'{repository}:latest'
@@ -1,16 +1,20 @@
+import re
 import time
+from datetime import datetime
+
 import docker
 import logging
 
+from shared.docker_wrapper.docker_auth import get_registry_auth
+from shared.docker_wrapper.docker_client import get_client
+from shared.docker_wrapper.docker_pull import pull_image
+from shared.timing import PhaseTimer
 from shared.docker_wrapper.docker_utils import extract_registry_from_image_name, DockerContainerStartError, InternalDockerError, \
-    InvalidParameterError, UnauthorizedError
-
-
-client = docker.from_env()
+    InvalidParameterError
 
 
 def run_container(image_name, subdomain, container_name, registry_credentials=None,
-                  network=None, traefik_domain=None, timeout=60):
+                  network=None, traefik_domain=None, timeout=60, stability_window=5, timer=None):
     """
     Run a Docker container from the given image name, and set up routing with Traefik.
 
@@ -21,22 +25,22 @@ def run_container(image_name, subdomain, container_name, registry_credentials=No
     :param network: The name of the Docker network to connect the container to Traefik
     :param traefik_domain: The base domain to use for routing with Traefik
     :param timeout
+    :param stability_window: The time (in seconds) the container has to stay running to be considered started
+    :param timer: PhaseTimer recording the durations of the registry authentication, the image pull, the container
+                  creation and the wait for the container
     :return: Tuple containing the container status, container ID, container name, routed domain, container logs, and the
              time the container was started
     """
+    timer = timer or PhaseTimer()
     try:
-        logging.info(f'Attempting to pull image: {image_name}')
+        auth_config = None
         if registry_credentials:
             registry = extract_registry_from_image_name(image_name)
             if not registry:
                 raise InvalidParameterError(f'Could not extract registry from image name {image_name}')
-            username, password = registry_credentials.split(':')
-            try:
-                login_result = client.login(username=username, password=password, registry=registry)
-            except docker.errors.APIError as e:
-                logging.error(f'API error: {str(e)}')
-                raise UnauthorizedError("Invalid registry credentials")
-            logging.info(f'Tried to log in to registry {registry} with username {username} with result {login_result}')
+            username, password = registry_credentials.split(':', 1)
+            with timer.phase('registry_auth'):
+                auth_config = get_registry_auth(registry, username, password)
 
         routed_domain = f"{subdomain}.app.{traefik_domain}"
 
@@ -46,18 +50,20 @@ def run_container(image_name, subdomain, container_name, registry_credentials=No
             f"traefik.http.routers.{subdomain}.entrypoints": "web",
         }
 
-        # pulling container image to run the latest version
-        logging.info(f'Attempting to pull image: {image_name}')
-        client.images.pull(image_name)
+        # pulling container image to run the latest version, skipped if the local image is up to date
+        with timer.phase('pull'):
+            pull_image(image_name, auth_config=auth_config)
 
         logging.info(f'Attempting to run container from image: {image_name}')
-        container = client.containers.run(image_name,
-                                          name=container_name,
-                                          detach=True,
-                                          labels=labels,
-                                          network=network)
-
-        wait_for_container(container, timeout)
+        with timer.phase('create'):
+            container = get_client('create').containers.run(image_name,
+                                                            name=container_name,
+                                                            detach=True,
+                                                            labels=labels,
+                                                            network=network)
+
+        with timer.phase('wait'):
+            container = wait_for_container(container, timeout, stability_window)
         logging.info('Started container with id: {}'.format(container.short_id))
 
         return (container.status, container.id, container.name,
@@ -71,41 +77,125 @@ def run_container(image_name, subdomain, container_name, registry_credentials=No
         raise InternalDockerError('API error: {}'.format(str(e)))
 
 
-def wait_for_container(container, timeout):
+def wait_for_container(container, timeout, stability_window=5):
     """
-    Monitors a Docker container, waiting for it to enter a 'running' state within a specified timeout period.
-    If the container does not start within the timeout or exits, it stops and removes the container, logs the failure,
-    and raises a DockerContainerStartError with relevant details.
+    Monitors a Docker container, waiting until it is confirmed stable or dead. Instead of polling the container state,
+    the function follows the Docker events stream of the container (start, die, oom and health_status events). The
+    container is considered stable once it has stayed running for `stability_window` seconds, or, if the image defines
+    a healthcheck, once Docker reports it as healthy. Events are replayed from the creation of the container, so no
+    state change is missed between starting the container and subscribing to its events.
+    If the container does not become stable within the timeout, dies or becomes unhealthy, it stops and removes the
+    container, logs the failure, and raises a DockerContainerStartError with relevant details.
 
     :param container: Docker Container object. The container to monitor.
     :param timeout: int. The maximum amount of time (in seconds) to wait for the container to start.
+    :param stability_window: float. The time (in seconds) the container has to stay running to be considered stable.
 
-    :return: None. This function does not return a value but may raise an exception if the container fails to start.
+    :return: Container. The container refreshed from the Docker daemon, bound to the client used for inspecting it.
 
     :raises DockerContainerStartError: If the container fails to start within the specified timeout or exits prematurely.
     This exception includes the error message, container logs, container status, and container ID.
     """
     start_time = time.time()
-    running = False
-
-    while not (container.status == 'running' and running):
-        if container.status == 'running':
-            running = True
-            logging.info(f'Container {container.id} is running, waiting if it will stay running.')
-        time.sleep(10)
-        container.reload()
-        logging.info(f'Waiting for container {container.id} to start. Status: {container.status}')
-        if time.time() - start_time > timeout or container.status == 'exited':
-            err = f'Container {container.id} failed to start in {time.time() - start_time}' \
-                  f' seconds. The status is {container.status}'
-            logging.error(err)
-
-            container_logs = container.logs().decode('utf-8')
-            container_status = container.status
-            container_id = container.id
-            logging.info(container_logs)
-            container.stop()
-            container.remove()
-            logging.info(f'Stopped and removed container {container.id}')
-
-            raise DockerContainerStartError(err, container_logs, container_status, container_id)
+    deadline = start_time + timeout
+    inspect_client = get_client('inspect')
+    container = inspect_client.containers.get(container.id)
+    has_healthcheck = bool((container.attrs.get('Config') or {}).get('Healthcheck'))
+    since = _created_timestamp(container.attrs['Created'])
+    stable_at = None
+    failure = None
+
+    try:
+        while failure is None:
+            now = time.time()
+            if stable_at is not None and not has_healthcheck and now >= stable_at:
+                container.reload()
+                if container.status == 'running':
+                    logging.info(f'Container {container.id} stayed running for {stability_window} seconds')
+                    return container
+                failure = f'Container {container.id} stopped running before it became stable.'
+                break
+            if now >= deadline:
+                failure = f'Container {container.id} failed to start in {now - start_time} seconds.'
+                break
+
+            # Follow the events until the next point at which a decision has to be made
+            until = deadline if stable_at is None or has_healthcheck else min(stable_at, deadline)
+            events = inspect_client.events(since=since, until=until, decode=True,
+                                           filters={'type': 'container', 'container': container.id})
+            try:
+                for event in events:
+                    action = event.get('Action') or event.get('status', '')
+                    since = _next_event_timestamp(event)
+                    logging.info(f'Container {container.id} event: {action}')
+
+                    if action == 'start':
+                        stable_at = time.time() + stability_window
+                        if not has_healthcheck:
+                            break
+                    elif action in ('die', 'oom'):
+                        failure = f'Container {container.id} exited {time.time() - start_time} seconds after start.'
+                        break
+                    elif action.startswith('health_status'):
+                        if 'unhealthy' in action:
+                            failure = f'Container {container.id} reported unhealthy status.'
+                            break
+                        if 'healthy' in action:
+                            container.reload()
+                            logging.info(f'Container {container.id} is healthy')
+                            return container
+            finally:
+                events.close()
+    except docker.errors.APIError:
+        # The container would otherwise keep running without being managed
+        try:
+            _stop_and_remove(container)
+        except docker.errors.APIError as e:
+            logging.error(f'Failed to stop and remove container {container.id}: {str(e)}')
+        raise
+
+    container.reload()
+    err = f'{failure} The status is {container.status}'
+    logging.error(err)
+
+    container_logs = container.logs().decode('utf-8')
+    container_status = container.status
+    container_id = container.id
+    logging.info(container_logs)
+    _stop_and_remove(container)
+
+    raise DockerContainerStartError(err, container_logs, container_status, container_id)
+
+
+def _stop_and_remove(container):
+    stop_client = get_client('stop')
+    stop_client.api.stop(container.id)
+    stop_client.api.remove_container(container.id)
+    logging.info(f'Stopped and removed container {container.id}')
+
+
+def _created_timestamp(created):
+    """
+    Converts the creation time of a container to the `since` timestamp of the Docker events API, which does not accept
+    the RFC 3339 format the creation time is reported in.
+
+    :param created: str. The creation time, e.g. '2024-05-01T12:34:56.123456789Z'.
+    :return: str. Timestamp in the 'seconds.nanoseconds' format accepted by the Docker events API.
+    """
+    match = re.fullmatch(r'(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d+))?(Z|[+-]\d{2}:\d{2})', created)
+    if match is None:
+        raise ValueError(f'Invalid container creation time: {created}')
+    seconds = int(datetime.strptime(match[1] + match[3], '%Y-%m-%dT%H:%M:%S%z').timestamp())
+    return f'{seconds}.{(match[2] or "").ljust(9, "0")[:9]}'
+
+
+def _next_event_timestamp(event):
+    """
+    Computes the `since` timestamp that follows the given Docker event, so that re-subscribing to the events stream
+    does not replay the event again.
+
+    :param event: dict. A decoded Docker event containing the 'timeNano' field.
+    :return: str. Timestamp in the 'seconds.nanoseconds' format accepted by the Docker events API.
+    """
+    time_nano = int(event['timeNano']) + 1
+    return f'{time_nano // 10 ** 9}.{time_nano % 10 ** 9:09d}'
@@ -1,22 +1,22 @@
 import time
-from typing import Optional
+from typing import Dict, Optional
 
 import docker
 import logging
 
+from shared.docker_wrapper.docker_client import get_client
 from shared.docker_wrapper.docker_utils import InternalDockerError, InvalidParameterError
 
 
-client = docker.from_env()
-
-
-def start_container(container_id: str) -> (Optional[int], str) or (None, str):
+def start_container(container_id: str, status: Optional[str] = None) -> (Optional[int], str) or (None, str):
     """
     Attempts to start a Docker container based on the given container ID. It checks if the container ID is not None,
     verifies whether the container is already running, and starts the container if it is not running.
     Logs are generated for each significant event, and specific errors are raised for exceptional conditions.
 
     :param container_id: str. The unique identifier for the Docker container to be started.
+    :param status: str, optional. The already known status of the container, e.g. from `list_containers`. If given,
+                   the container is not inspected before it is started.
 
     :return: Tuple (int, str) or (None, str). Returns a tuple containing the UNIX timestamp at which the container
              was started and a message indicating the action taken ('Started container {container_id}' or
@@ -26,19 +26,20 @@ def start_container(container_id: str) -> (Optional[int], str) or (None, str):
     :raises InvalidParameterError: If the `container_id` is None or if the specified container cannot be found.
     :raises InternalDockerError: If there is an API error while attempting to start the container.
 
-    Note: This function requires the 'docker' Python module for interacting with Docker and assumes that a Docker
-    client (`client`) has been instantiated and is globally accessible. It also presupposes custom exception classes
+    Note: This function requires the 'docker' Python module for interacting with Docker and obtains the Docker
+    client from the shared `get_client` factory. It also presupposes custom exception classes
     (`InvalidParameterError`, `InternalDockerError`) for handling specific error conditions.
     """
     try:
         if container_id is None:
             logging.error('Container ID cannot be None')
             raise InvalidParameterError('Container ID cannot be None')
-        container = client.containers.get(container_id)
-        if container.status == 'running':
+        if status is None:
+            status = get_client('inspect').containers.get(container_id).status
+        if status == 'running':
             logging.info(f'Container {container_id} is already running')
             return None, f'Container {container_id} is already running'
-        container.start()
+        get_client().api.start(container_id)
         logging.info(f'Started container {container_id}')
         return int(time.time()), f'Started container {container_id}'
     except docker.errors.NotFound:
@@ -49,3 +50,20 @@ def start_container(container_id: str) -> (Optional[int], str) or (None, str):
         err = f'API error for container {container_id}: {str(e)}'
         logging.error(err)
         raise InternalDockerError(err)
+
+
+def list_containers() -> Dict[str, str]:
+    """
+    Lists all containers on the Docker host, including the stopped ones, with a single Docker API call.
+
+    :return: dict. A dictionary mapping the container IDs to their statuses (e.g. 'running', 'exited').
+
+    :raises InternalDockerError: If there is an API error while listing the containers.
+    """
+    try:
+        containers = get_client('inspect').containers.list(all=True, sparse=True)
+    except docker.errors.APIError as e:
+        err = f'API error while listing containers: {str(e)}'
+        logging.error(err)
+        raise InternalDockerError(err)
+    return {container.id: container.status for container in containers}
@@ -0,0 +1,195 @@
+import glob
+import logging
+import os
+import threading
+import time
+
+import redis
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.mmap_dict import MmapedDict
+from rq import Queue, Worker
+
+
+# The RQ worker runs every job in a forked process, so the metrics of the jobs are shared with the worker process
+# through the files in this directory. It has to be set before the metrics are created.
+multiprocess_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+# Serializes the scrapes with the merging of the files of exited processes, so a scrape never reads the metrics of a
+# process both from its own files and from the merged files, or from neither of them
+merge_lock = threading.Lock()
+merged_files = {}
+
+job_duration_buckets = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+call_duration_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+job_wait_seconds = Histogram('rq_job_wait_seconds', 'Time jobs spent waiting in the queue before being started',
+                             ['queue', 'task'], buckets=job_duration_buckets)
+job_run_seconds = Histogram('rq_job_run_seconds', 'Time spent executing jobs',
+                            ['queue', 'task', 'outcome'], buckets=job_duration_buckets)
+worker_busy_seconds = Counter('rq_worker_busy_seconds', 'Time the worker spent executing jobs')
+docker_call_seconds = Histogram('docker_api_call_seconds', 'Latency of the Docker API calls until the response headers',
+                                ['operation', 'method'], buckets=call_duration_buckets)
+redis_call_seconds = Histogram('redis_call_seconds', 'Latency of the Redis commands and pipelines',
+                               ['command'], buckets=call_duration_buckets)
+image_pull_seconds = Histogram('docker_image_pull_seconds', 'Duration of the image pulls',
+                               ['result'], buckets=job_duration_buckets)
+image_pull_bytes = Counter('docker_image_pull_bytes', 'Compressed size of the image layers downloaded by pulls')
+deploy_outcomes = Counter('deploy_outcomes', 'Finished deployments by the resulting application status',
+                          ['status', 'status_code'])
+
+
+def build_registry(*collectors):
+    """
+    Builds the registry of the metrics exposed by a process. When PROMETHEUS_MULTIPROC_DIR is set, the registry
+    aggregates the metrics written by all processes sharing the directory, otherwise it exposes the metrics of the
+    current process.
+
+    :param collectors: Additional collectors computing their metrics at scrape time.
+    :return: CollectorRegistry. The registry to be exposed to Prometheus.
+    """
+    if multiprocess_dir:
+        registry = CollectorRegistry()
+        LockedMultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    for collector in collectors:
+        registry.register(collector)
+    return registry
+
+
+def merge_process_metrics(pid):
+    """
+    Adds the counters, histograms and summaries written by an exited process to the merged metrics files of the current
+    process and deletes the files of the exited process. RQ forks a work horse for every job, so without merging the
+    directory would gain files with every job, and every scrape would read all of them.
+
+    :param pid: int. The ID of the exited process.
+
+    Note: Does nothing when PROMETHEUS_MULTIPROC_DIR is not set. Gauges are not merged, the files of the live gauges of
+    the process are deleted.
+    """
+    if not multiprocess_dir:
+        return
+
+    with merge_lock:
+        for path in glob.glob(os.path.join(multiprocess_dir, f'*_{pid}.db')):
+            typ = os.path.basename(path).split('_')[0]
+            if typ not in ('counter', 'histogram', 'summary'):
+                continue
+            merged = merged_files.get(typ)
+            if merged is None:
+                merged = merged_files[typ] = MmapedDict(
+                    os.path.join(multiprocess_dir, f'{typ}_merged_{os.getpid()}.db'))
+            for key, value, timestamp, _ in MmapedDict.read_all_values_from_file(path):
+                merged_value, merged_timestamp = merged.read_value(key)
+                merged.write_value(key, merged_value + value, max(merged_timestamp, timestamp))
+            os.remove(path)
+        multiprocess.mark_process_dead(pid, multiprocess_dir)
+
+
+def observe_docker_call(operation):
+    """
+    Creates a requests response hook recording the latency of the Docker API calls made by a client.
+
+    :param operation: str. The kind of operation the client is used for.
+    :return: function. The hook to be added to the response hooks of the Docker API client.
+
+    Note: The latency is measured until the response headers are received, so streamed responses such as the events
+    or the pull progress are not included in full.
+    """
+    def hook(response, *args, **kwargs):
+        docker_call_seconds.labels(operation, response.request.method).observe(response.elapsed.total_seconds())
+    return hook
+
+
+class InstrumentedRedis(redis.Redis):
+    """
+    Redis client recording the latency of every command, and of every executed pipeline as a whole.
+    """
+
+    def execute_command(self, *args, **options):
+        start = time.monotonic()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            redis_call_seconds.labels(str(args[0]).upper()).observe(time.monotonic() - start)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        start = time.monotonic()
+        try:
+            return super().execute(raise_on_error)
+        finally:
+            redis_call_seconds.labels('PIPELINE').observe(time.monotonic() - start)
+
+
+class LockedMultiProcessCollector(multiprocess.MultiProcessCollector):
+    """
+    Multiprocess collector not reading the metrics files while the files of an exited process are merged.
+    """
+
+    def collect(self):
+        with merge_lock:
+            return super().collect()
+
+
+class MetricsWorker(Worker):
+    """
+    RQ worker recording the wait and run times of the jobs by task and the time the worker is busy. The metrics of
+    every work horse are merged into the metrics of the worker once the work horse exits.
+    """
+
+    def execute_job(self, job, queue):
+        # Runs in the worker process, for the whole lifetime of the work horse
+        start = time.monotonic()
+        try:
+            return super().execute_job(job, queue)
+        finally:
+            worker_busy_seconds.inc(time.monotonic() - start)
+
+    def monitor_work_horse(self, job, queue):
+        # Runs in the worker process until the work horse exits
+        horse_pid = self.horse_pid
+        super().monitor_work_horse(job, queue)
+        merge_process_metrics(horse_pid)
+
+    def perform_job(self, job, queue):
+        # Runs in the forked work horse
+        start = time.monotonic()
+        succeeded = False
+        try:
+            succeeded = super().perform_job(job, queue)
+            return succeeded
+        finally:
+            task = job.func_name
+            job_run_seconds.labels(queue.name, task, 'success' if succeeded else 'failure') \
+                .observe(time.monotonic() - start)
+            if job.enqueued_at and job.started_at:
+                job_wait_seconds.labels(queue.name, task) \
+                    .observe(max(0.0, (job.started_at - job.enqueued_at).total_seconds()))
+
+
+class QueueDepthCollector:
+    """
+    Collects the number of jobs waiting in every RQ queue at scrape time.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        depth = GaugeMetricFamily('rq_queue_depth', 'Number of jobs waiting in the queue', labels=['queue'])
+        try:
+            for queue in Queue.all(connection=self.connection):
+                depth.add_metric([queue.name], queue.count)
+        except redis.exceptions.RedisError as e:
+            logging.error('Redis error: {}'.format(str(e)))
+        yield depth
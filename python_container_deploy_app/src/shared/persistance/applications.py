@@ -2,18 +2,40 @@ import json
 import logging
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 
-from shared.persistance.redis_persistance import save_to_redis, InternalRedisError, flush_redis
-from shared.persistance.redis_persistance import get_applications as get_applications_from_redis
+from shared.persistance.redis_persistance import update_fields_in_redis, InternalRedisError, flush_redis, \
+    get_deploy_timings as get_deploy_timings_from_redis, append_logs, get_logs
+from shared.timing import percentile
+from shared.persistance.redis_persistance import scan_team_ids, get_applications_by_ids
 from shared.persistance.redis_persistance import get_application as get_application_from_redis
 
 traefik_domain = os.environ.get('BASE_DOMAIN', 'localhost')
 traefik_network = os.environ.get('TRAEFIK_NETWORK', 'traefik_default')
 deploy_timeout = int(os.environ.get('DEPLOY_TIMEOUT', 60))
 loki_url = os.environ.get('LOKI_URL', 'http://loki:3100/')
+logs_freshness = float(os.environ.get('LOGS_FRESHNESS', 60))
+loki_batch_size = int(os.environ.get('LOKI_BATCH_SIZE', 20))
+loki_concurrency = int(os.environ.get('LOKI_CONCURRENCY', 4))
+loki_timeout = float(os.environ.get('LOKI_TIMEOUT', 10))
+# Oldest logs requested from Loki, in seconds, so the range of a query stays below the limit of Loki
+loki_max_lookback = float(os.environ.get('LOKI_MAX_LOOKBACK', 7 * 24 * 3600))
+# Number of applications read from Redis in one batch while listing them, the default page size
+applications_page_size = int(os.environ.get('APPLICATIONS_PAGE_SIZE', 100))
+
+# Fields only listed when they are requested explicitly
+on_demand_fields = ('logs',)
+# Fields read to refresh the logs of an application
+logs_update_fields = ('team_id', 'container_id', 'logs_updated_at', 'logs_until')
+
+# Keep-alive connections to Loki shared by all log refreshes
+loki_session = requests.Session()
+loki_session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=loki_concurrency))
+loki_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=loki_concurrency))
 
 logging.basicConfig(level=logging.INFO)
 
@@ -25,7 +47,8 @@ class InternalError(Exception):
 def get_application(team_id):
     """
     Retrieves an application's details for a specified team ID from Redis and updates its logs by querying Loki.
-    If the application is found in Redis, it attempts to update the logs before returning the application object.
+    If the application is found in Redis, it attempts to update the logs and loads them from the log store before
+    returning the application object.
     The function returns a tuple containing the application data (or an error message) and an HTTP status code.
     The status code indicates whether the operation was successful (200), not found (404), or resulted in an internal
     error (500).
@@ -51,6 +74,7 @@ def get_application(team_id):
             return err, 404
 
         application = update_logs(application)
+        load_logs([application])
         return application, 200
     except InternalRedisError as e:
         return str(e), 500
@@ -59,81 +83,252 @@ def get_application(team_id):
 def update_logs(application):
     """
     Updates the application's log entries by querying Loki for the latest logs associated with the application's container.
-    It performs this update if the logs are older than 60 seconds or if it's the initial update (logs are missing).
-    The function checks for the presence of 'container_id' in the application object and queries Loki using this identifier.
-    If successful, it updates the application object with the latest logs and the timestamp of the update. If the logs
-    cannot be retrieved or if there's an issue with saving the updated logs to Redis, the function logs the appropriate
-    error but still returns the application object, potentially unmodified.
+    It performs this update if the logs are older than the freshness window or if it's the initial update (logs are missing).
+    If the logs cannot be retrieved or if there's an issue with saving the updated logs to Redis, the function logs the
+    appropriate error but still returns the application object, potentially unmodified.
 
     :param application: dict. A dictionary representing the application, containing at least 'logs_updated_at',
                         'container_id', and 'team_id' keys.
-    :return: dict. The updated application object, which may include new log entries and an updated 'logs_updated_at' timestamp.
+    :return: dict. The updated application object, with an updated 'logs_updated_at' timestamp.
 
-    Note: This function assumes global access to a configured logger, the URL of the Loki instance (`loki_url`),
-    and a function `save_to_redis` for persisting the application object. It handles exceptions raised by the requests
-    library for HTTP requests and a custom `InternalRedisError` for Redis operations.
+    Note: This function is a single application shortcut for `update_logs_batch`.
     """
-    logs_updated_at: Optional[str] = application.get('logs_updated_at')
+    return update_logs_batch([application])[0]
 
-    if logs_updated_at and time.time() - float(logs_updated_at) < 60:
-        logging.debug(f"Logs for team {application.get('team_id')} are up to date")
-        return application
 
-    container_id = application.get('container_id')
-    if not container_id:
-        err = f'No container information stored for team {application.get("team_id")}\n'
-        logging.info(err)
-        return application
-
-    query = "{container_id=\"" + container_id + "\"}"
-    url = f'{loki_url}/loki/api/v1/query_range?query={query}'
+def update_logs_batch(applications):
+    """
+    Updates the log entries of multiple applications by querying Loki. Only applications with a container whose logs
+    are older than the freshness window (LOGS_FRESHNESS seconds) or missing are refreshed. The containers are split
+    into groups of LOKI_BATCH_SIZE and the logs of every group are fetched with a single LogQL query matching all
+    container IDs of the group. The groups are queried concurrently over a pooled HTTP session. Only the log lines
+    newer than the 'logs_until' timestamp of an application are requested and appended to its log store, all in a
+    single pipeline.
+
+    :param applications: list. A list of dictionaries representing the applications, containing at least
+                         'logs_updated_at', 'logs_until', 'container_id', and 'team_id' keys. The dictionaries are
+                         updated in place.
+    :return: list. The same list of applications, which may include updated 'logs_updated_at' and 'logs_until'
+             timestamps. The logs themselves are loaded with `load_logs`.
+
+    Note: A failure of a Loki query only leaves the applications of the affected group unmodified. A failure to save
+    the logs to Redis is logged.
+    """
+    now = time.time()
+    stale = {}
+    for application in applications:
+        logs_updated_at: Optional[str] = application.get('logs_updated_at')
+        if logs_updated_at and now - float(logs_updated_at) < logs_freshness:
+            logging.debug(f"Logs for team {application.get('team_id')} are up to date")
+            continue
+
+        container_id = application.get('container_id')
+        if not container_id:
+            logging.info(f'No container information stored for team {application.get("team_id")}\n')
+            continue
+        stale[container_id] = application
+
+    if not stale:
+        return applications
+
+    container_ids = list(stale)
+    groups = [container_ids[i:i + loki_batch_size] for i in range(0, len(container_ids), loki_batch_size)]
+    updates = {}
+    new_logs = {}
+    with ThreadPoolExecutor(max_workers=min(loki_concurrency, len(groups))) as executor:
+        starts = [_logs_start([stale[container_id] for container_id in group], now) for group in groups]
+        for group, logs in zip(groups, executor.map(_query_logs, groups, starts)):
+            if logs is None:
+                continue
+            for container_id in group:
+                application = stale[container_id]
+                fields = {'logs_updated_at': time.time()}
+                logs_until = int(application.get('logs_until') or 0)
+                values = [value for value in logs.get(container_id, []) if int(value[0]) > logs_until]
+                if values:
+                    fields['logs_until'] = values[0][0]
+                    new_logs[application['team_id']] = values[::-1]
+                else:
+                    logging.debug(f"No new logs found for container {container_id}")
+                application.update(fields)
+                updates[application['team_id']] = fields
 
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        logs = response.json()
-        application['logs_updated_at'] = time.time()
+        # The logs are appended first, a failure leaves the timestamps unchanged and the logs are requested again
+        append_logs(new_logs)
+        update_fields_in_redis(updates)
+    except InternalRedisError:
+        logging.error(f"Failed to save logs of {len(updates)} applications to redis")
 
-        if not logs['data']['result']:
-            logging.debug(f"No logs found for container {container_id}")
-            return application
+    return applications
 
-        application['logs'] = json.dumps(logs['data']['result'][0]['values'])
 
-        try:
-            save_to_redis(application)
-        except InternalRedisError as e:
-            logging.error(f"Failed to save application {application} to redis")
+def _logs_start(applications, now):
+    # The oldest of the logs_until timestamps of the applications, or None to query the default range of Loki
+    marks = [application.get('logs_until') for application in applications]
+    if not all(marks):
+        return None
+    return max(min(int(mark) for mark in marks), int((now - loki_max_lookback) * 1e9))
 
-        return application
 
-    except requests.exceptions.RequestException as e:
-        err = f'Failed to get logs for container {container_id}: {str(e)}\n'
-        logging.error(err)
-        return application
+def load_logs(applications):
+    """
+    Loads the logs of the applications from the log store, in a single pipelined round trip.
 
+    :param applications: list. A list of dictionaries representing the applications, containing at least the
+                         'team_id' key. The 'logs' key of every dictionary is set in place to the JSON encoded list
+                         of the log entries ([timestamp, line] pairs, newest first).
+    :return: list. The same list of applications.
 
-def get_applications():
+    :raises InternalRedisError: If the logs can not be read from Redis.
     """
-    Retrieves a list of all applications stored in Redis and updates their logs by querying Loki for each application.
-    This operation is atomic - either all applications are successfully updated, or an error is returned without partial updates.
-    If an error occurs while accessing Redis, the function returns an error message and a 500 status code.
+    logs = get_logs([application['team_id'] for application in applications])
+    for application in applications:
+        application['logs'] = json.dumps(logs[application['team_id']][::-1])
+    return applications
+
+
+def _query_logs(container_ids, start=None):
+    """
+    Fetches the logs of a group of containers from Loki with a single LogQL query.
+
+    :param container_ids: list. The IDs of the containers.
+    :param start: int, optional. The timestamp of the oldest requested log line in nanoseconds, the default range of
+                  Loki is queried if None.
+    :return: dict or None. A dictionary mapping the container IDs to their log values ([timestamp, line] pairs,
+             newest first), or None if the query failed.
+    """
+    query = '{container_id=~"' + '|'.join(container_ids) + '"}'
+    url = f'{loki_url}/loki/api/v1/query_range'
+    params = {'query': query, 'limit': 100 * len(container_ids)}
+    if start is not None:
+        params['start'] = start
+
+    try:
+        # The limit is applied to the whole query, keep the default limit of 100 lines per container
+        response = loki_session.get(url, params=params, timeout=loki_timeout)
+        response.raise_for_status()
+        streams = response.json()['data']['result']
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        logging.error(f'Failed to get logs for containers {", ".join(container_ids)}: {str(e)}\n')
+        return None
+
+    logs = {}
+    for stream in streams:
+        container_id = stream.get('stream', {}).get('container_id')
+        logs.setdefault(container_id, []).extend(stream.get('values', []))
+    for values in logs.values():
+        values.sort(key=lambda value: int(value[0]), reverse=True)
+    return logs
 
-    :return: Tuple (list or str, int). Returns a tuple where the first element is a list of application objects
-             (each as a dictionary) with updated logs, or an error message (as a string) if an internal error occurs
-             during the Redis operation. The second element is an HTTP status code indicating the outcome of the operation
-             (200 for success, 500 for internal errors).
 
-    Note: Assumes global access to `get_applications_from_redis` for fetching applications and `update_logs`
-    for updating logs for each application. Relies on handling a custom `InternalRedisError` exception for Redis-related
-    errors. Applications are expected to be dictionaries with necessary information for `update_logs`.
+def list_applications(cursor=None, limit=None, fields=None, statuses=None, team_ids=None):
     """
+    Lists the applications stored in Redis. The team IDs are iterated with a cursor based SSCAN and the fields of every
+    batch of applications are read with a single pipeline, so the applications can be serialized while they are read.
+    Only the requested fields are read from Redis. The logs are only listed when requested and are then refreshed from
+    Loki and loaded from the log store batch by batch.
+
+    Without a cursor and a limit, all applications are listed. With either of them a single page is listed, starting
+    at the cursor (0 for the first page) and containing about `limit` applications, as Redis treats the limit as a hint.
+    The applications of the given team IDs are listed without any scan.
+
+    :param cursor: int, optional. The cursor returned with the previous page.
+    :param limit: int, optional. The requested number of applications in the page (default is APPLICATIONS_PAGE_SIZE).
+    :param fields: list, optional. The fields to list, all fields except the logs if None. The team ID is always listed.
+    :param statuses: list, optional. Only the applications with one of the statuses are listed.
+    :param team_ids: list, optional. Only the applications of the teams are listed.
+
+    :return: Tuple (tuple or str, int). Returns a tuple where the first element is a tuple of the cursor of the next
+             page (0 after the last page, None if all applications are listed) and an iterator over the applications
+             (each as a dictionary), or an error message (as a string) if an internal error occurs during the Redis
+             operation. The second element is an HTTP status code indicating the outcome of the operation (200 for
+             success, 500 for internal errors).
+
+    Note: The first batch of team IDs is read before returning, so an unreachable Redis results in an error. A Redis
+    error raised later by the iterator is an InternalRedisError. When all applications are listed, an application
+    returned more than once by the scan is only listed once; across pages, an application may be listed twice.
+    """
+    if fields is not None:
+        fields = list(dict.fromkeys(['team_id'] + list(fields)))
+    refresh_logs = fields is not None and 'logs' in fields
+    read_fields = None
+    if fields is not None:
+        read_fields = list(dict.fromkeys(fields + (list(logs_update_fields) if refresh_logs else []) +
+                                         (['status'] if statuses else [])))
+
+    if team_ids is not None:
+        return (None, _iter_applications([list(dict.fromkeys(team_ids))], read_fields, fields, statuses,
+                                         refresh_logs)), 200
+
+    paged = cursor is not None or limit is not None
     try:
-        applications = get_applications_from_redis()
-        map(update_logs, applications)
+        next_cursor, first_batch = scan_team_ids(cursor or 0, limit or applications_page_size)
     except InternalRedisError as e:
         return str(e), 500
-    return applications, 200
+
+    if paged:
+        return (next_cursor, _iter_applications([first_batch], read_fields, fields, statuses, refresh_logs)), 200
+    batches = _scan_batches(next_cursor, first_batch)
+    return (None, _iter_applications(batches, read_fields, fields, statuses, refresh_logs)), 200
+
+
+def _scan_batches(cursor, batch):
+    seen = set()
+    while True:
+        # SSCAN may return a team ID more than once
+        batch = [team_id for team_id in batch if team_id not in seen]
+        seen.update(batch)
+        yield batch
+        if cursor == 0:
+            return
+        cursor, batch = scan_team_ids(cursor, applications_page_size)
+
+
+def _iter_applications(batches, read_fields, fields, statuses, refresh_logs):
+    for team_ids in batches:
+        for start in range(0, len(team_ids), applications_page_size):
+            applications = get_applications_by_ids(team_ids[start:start + applications_page_size], read_fields)
+            if statuses:
+                applications = [application for application in applications if application.get('status') in statuses]
+            if refresh_logs:
+                update_logs_batch(applications)
+                load_logs(applications)
+            for application in applications:
+                if fields is None:
+                    yield {key: value for key, value in application.items() if key not in on_demand_fields}
+                else:
+                    yield {field: application[field] for field in fields if field in application}
+
+
+def get_deploy_timings():
+    """
+    Summarizes the durations of the phases of the latest deployments. For every phase, the number of recorded
+    durations, their 50th, 90th, 95th and 99th percentiles and the maximum are computed from the rolling window of
+    the latest durations kept in Redis.
+
+    :return: Tuple (dict or str, int). Returns a tuple where the first element is a dictionary mapping phase names to
+             their summaries (with the durations in seconds), or an error message (as a string) if an internal error
+             occurs during the Redis operation. The second element is an HTTP status code indicating the outcome of the
+             operation (200 for success, 500 for internal errors).
+    """
+    try:
+        timings = get_deploy_timings_from_redis()
+    except InternalRedisError as e:
+        return str(e), 500
+
+    summary = {}
+    for phase, durations in timings.items():
+        durations = sorted(durations)
+        summary[phase] = {
+            'count': len(durations),
+            'p50': percentile(durations, 0.5),
+            'p90': percentile(durations, 0.9),
+            'p95': percentile(durations, 0.95),
+            'p99': percentile(durations, 0.99),
+            'max': durations[-1] if durations else None,
+        }
+    return summary, 200
 
 
 def reset_redis():
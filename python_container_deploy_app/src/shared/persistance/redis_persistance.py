@@ -1,13 +1,23 @@
+import json
 import redis
 import logging
 import os
+import zlib
+
+from shared.metrics import InstrumentedRedis
 
 redis_host = os.getenv('REDIS_HOST', 'redis-db')
 redis_port = int(os.getenv('REDIS_PORT', 6379))
 rq_db_id = int(os.getenv('RQ_DB', 1))
+# Per team caps of the log store, the oldest chunks are evicted once the compressed chunks exceed either of them
+logs_max_bytes = int(os.getenv('LOGS_MAX_BYTES', 256 * 1024))
+logs_max_chunks = int(os.getenv('LOGS_MAX_CHUNKS', 64))
 
-redis_db = redis.Redis(host=redis_host, port=redis_port, db=0, charset="utf-8", decode_responses=True)
+# The latency of the application data operations is recorded in the Redis call metrics
+redis_db = InstrumentedRedis(host=redis_host, port=redis_port, db=0, charset="utf-8", decode_responses=True)
 redis_queue = redis.Redis(host=redis_host, port=redis_port, db=rq_db_id, charset="utf-8")
+# The compressed log chunks are binary, they are read and written without decoding
+redis_logs_db = InstrumentedRedis(host=redis_host, port=redis_port, db=0)
 
 
 def get_application(team_id):
@@ -36,31 +46,99 @@ def get_application(team_id):
     return None
 
 
-def get_applications():
+def get_applications(strict=True):
     """
-    Retrieves the data for all applications listed in the set of managed applications in Redis. It iterates over
-    all team IDs in the managed applications set, fetching each application's data. If any application data cannot
-    be found or if the Redis data is inconsistent, it logs an error and raises an InternalRedisError.
+    Retrieves the data for all applications listed in the set of managed applications in Redis. The team IDs are read
+    first and then all application hashes are fetched in a single pipelined round trip, so the number of round trips
+    does not grow with the number of applications. If any application data cannot be found, the Redis data is
+    inconsistent, it logs an error and raises an InternalRedisError.
+
+    :param strict: bool, optional. If False, an application without data is returned as a dictionary containing only
+                   the 'team_id' key instead of raising an InternalRedisError (default is True).
 
     :return: list. A list of dictionaries, each representing an application's data.
 
     :raises InternalRedisError: If there's an inconsistency in the Redis data or if any application data cannot be retrieved.
 
-    Note: Leverages the `get_application` function for fetching individual application data and assumes a global Redis
-    connection (`redis_db`) and configured logging.
+    Note: Assumes a global Redis connection (`redis_db`) and configured logging.
     """
-    team_ids = get_all_team_ids()
+    try:
+        team_ids = list(get_all_team_ids())
+        pipeline = redis_db.pipeline(transaction=False)
+        for team_id in team_ids:
+            pipeline.hgetall(team_id)
+        hashes = pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
     applications = []
-    for team_id in team_ids:
-        application = get_application(team_id)
+    for team_id, application in zip(team_ids, hashes):
         if not application:
             err = f'No application data for team {team_id}, the state of the db is inconsistent\n'
             logging.error(err)
-            raise InternalRedisError(err)
+            if strict:
+                raise InternalRedisError(err)
+            application = {'team_id': team_id}
         applications.append(application)
     return applications
 
 
+def scan_team_ids(cursor, count):
+    """
+    Retrieves a batch of team IDs from the set of managed applications with a cursor based SSCAN, so listing the
+    applications never blocks Redis. A full iteration returns every application managed during the whole iteration
+    at least once, an application may be returned more than once.
+
+    :param cursor: int. The cursor returned by the previous call, 0 to start a new iteration.
+    :param count: int. The number of team IDs to ask for. Redis may return more or fewer IDs.
+
+    :return: Tuple (int, list). The cursor of the next batch (0 once the iteration is complete) and the team IDs.
+
+    :raises InternalRedisError: If the Redis operation fails, encapsulating the original Redis error.
+    """
+    try:
+        return redis_db.sscan('managed_applications', cursor, count=count)
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+
+def get_applications_by_ids(team_ids, fields=None):
+    """
+    Retrieves the data of the given applications in a single pipelined round trip. Unlike `get_applications`, only
+    the requested fields are read and applications which are not managed, or were deleted in the meantime, are
+    skipped instead of being reported as an inconsistency.
+
+    :param team_ids: list. The team IDs of the applications.
+    :param fields: list, optional. The names of the fields to read, all fields are read if None.
+
+    :return: list. The applications as dictionaries of their stored fields, in the order of the team IDs.
+
+    :raises InternalRedisError: If the Redis pipeline fails, encapsulating the original Redis error.
+    """
+    try:
+        pipeline = redis_db.pipeline(transaction=False)
+        for team_id in team_ids:
+            pipeline.sismember('managed_applications', team_id)
+            if fields is None:
+                pipeline.hgetall(team_id)
+            else:
+                pipeline.hmget(team_id, *fields)
+        results = pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+    applications = []
+    for team_id, managed, values in zip(team_ids, results[::2], results[1::2]):
+        if fields is not None:
+            values = {field: value for field, value in zip(fields, values) if value is not None}
+        if managed and values:
+            applications.append(values)
+    return applications
+
+
 def is_subdomain_used(subdomain):
     """
     Checks if a given subdomain is already used by any managed application by querying the set of used subdomains in Redis.
@@ -92,7 +170,8 @@ def save_to_redis(application):
     """
     Saves the application data to Redis, using the team ID as the key. It adds the team ID to a set of managed
     applications and the application's subdomain to a set of used subdomains. If the application does not contain an
-    "error" field, any existing "error" field for the application in Redis is removed.
+    "error" field, any existing "error" field for the application in Redis is removed. A "logs" field is not saved,
+    the logs are kept in the log store (see `append_logs`).
 
     :param application: dict. A dictionary containing the application data, including "team_id" and "subdomain" keys.
 
@@ -115,7 +194,69 @@ def save_to_redis(application):
                 redis_db.hdel(team_id, "error")
 
         logging.info(f"Saving application data for team {team_id} to Redis")
-        redis_db.hset(team_id, mapping=application)
+        # The logs are kept in the log store, see append_logs(..., replace=True)
+        pipeline = redis_db.pipeline()
+        pipeline.hdel(team_id, 'logs')
+        pipeline.hset(team_id, mapping={key: value for key, value in application.items() if key != 'logs'})
+        pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+
+def save_many_to_redis(applications):
+    """
+    Saves the data of multiple applications to Redis in a single pipelined round trip. The same rules as in
+    `save_to_redis` apply to every application: the team ID is added to the set of managed applications, the
+    subdomain to the set of used subdomains, the "error" field is removed if it is not in the application dict, and
+    the "logs" field is not saved.
+
+    :param applications: list. A list of dictionaries containing the application data, including "team_id" and
+                         "subdomain" keys.
+
+    :raises InternalRedisError: If the Redis pipeline fails, encapsulating the original Redis error.
+
+    Note: Assumes a global Redis connection (`redis_db`) and that logging is configured.
+    """
+    if not applications:
+        return
+
+    try:
+        pipeline = redis_db.pipeline()
+        for application in applications:
+            team_id = application["team_id"]
+            pipeline.sadd('managed_applications', team_id)
+            pipeline.sadd('used_subdomains', application["subdomain"])
+            if "error" not in application:
+                pipeline.hdel(team_id, "error")
+            pipeline.hdel(team_id, 'logs')
+            pipeline.hset(team_id, mapping={key: value for key, value in application.items() if key != 'logs'})
+        logging.info(f"Saving application data for {len(applications)} teams to Redis")
+        pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+
+def update_fields_in_redis(updates):
+    """
+    Updates selected fields of multiple applications in Redis in a single pipelined round trip. Unlike
+    `save_to_redis`, only the given fields are written, so concurrent changes of other fields are not overwritten.
+
+    :param updates: dict. A dictionary mapping team IDs to dictionaries of the fields to set.
+
+    :raises InternalRedisError: If the Redis pipeline fails, encapsulating the original Redis error.
+
+    Note: Assumes a global Redis connection (`redis_db`) and that logging is configured.
+    """
+    if not updates:
+        return
+
+    try:
+        pipeline = redis_db.pipeline(transaction=False)
+        for team_id, fields in updates.items():
+            pipeline.hset(team_id, mapping=fields)
+        pipeline.execute()
     except redis.exceptions.RedisError as e:
         logging.error('Redis error: {}'.format(str(e)))
         raise InternalRedisError('Redis error: {}'.format(str(e)))
@@ -148,12 +289,180 @@ def delete_from_redis(team_id):
     pipeline = redis_db.pipeline()
     pipeline.srem('managed_applications', team_id)
     pipeline.srem('used_subdomains', application['subdomain'])
-    pipeline.delete(team_id)
+    pipeline.delete(team_id, *_logs_keys(team_id))
     pipeline.execute()
     logging.info(f'Deleted application data for team {team_id}\n')
     return True, None
 
 
+def delete_many_from_redis(applications):
+    """
+    Deletes the data of multiple applications from Redis in a single pipelined round trip. The team IDs are removed
+    from the set of managed applications, their subdomains from the set of used subdomains, and the application
+    hashes are unlinked.
+
+    :param applications: list. A list of dictionaries containing at least the "team_id" key and, if known, the
+                         "subdomain" key of every application to delete.
+
+    :return: list. The team IDs of the deleted applications.
+
+    :raises InternalRedisError: If the Redis pipeline fails, encapsulating the original Redis error.
+
+    Note: Assumes a global Redis connection (`redis_db`). Unlike `delete_from_redis`, no consistency checks are done,
+    the function is intended for the mass deletion of applications.
+    """
+    if not applications:
+        return []
+
+    team_ids = [application['team_id'] for application in applications]
+    subdomains = [application['subdomain'] for application in applications if application.get('subdomain')]
+    try:
+        pipeline = redis_db.pipeline()
+        pipeline.srem('managed_applications', *team_ids)
+        if subdomains:
+            pipeline.srem('used_subdomains', *subdomains)
+        pipeline.unlink(*team_ids, *[key for team_id in team_ids for key in _logs_keys(team_id)])
+        pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+    logging.info(f'Deleted application data for {len(team_ids)} teams\n')
+    return team_ids
+
+
+def _logs_keys(team_id):
+    # The list of the compressed chunks, oldest first, and the total size of the chunks in bytes
+    return f'logs:{team_id}', f'logs_size:{team_id}'
+
+
+_append_logs_script = redis_logs_db.register_script("""
+redis.call('RPUSH', KEYS[1], ARGV[1])
+local size = redis.call('INCRBY', KEYS[2], string.len(ARGV[1]))
+local count = redis.call('LLEN', KEYS[1])
+while count > 1 and (size > tonumber(ARGV[2]) or count > tonumber(ARGV[3])) do
+    size = redis.call('INCRBY', KEYS[2], -string.len(redis.call('LPOP', KEYS[1])))
+    count = count - 1
+end
+return size
+""")
+
+
+def append_logs(logs, replace=False):
+    """
+    Appends log entries to the log store of the applications, in a single pipelined round trip. The entries of every
+    application are compressed into one chunk and pushed to the capped list of chunks of the team. Once the chunks of
+    a team exceed LOGS_MAX_BYTES bytes or LOGS_MAX_CHUNKS chunks, the oldest chunks are evicted by the same atomic
+    script, so the memory used by the logs of a team stays bounded.
+
+    :param logs: dict. A dictionary mapping team IDs to lists of log entries ([timestamp, line] pairs, oldest first).
+    :param replace: bool, optional. If True, the stored logs of the teams are deleted first (default is False).
+
+    :raises InternalRedisError: If the Redis pipeline fails, encapsulating the original Redis error.
+
+    Note: A chunk larger than LOGS_MAX_BYTES is stored with only its newest entries.
+    """
+    try:
+        pipeline = redis_logs_db.pipeline(transaction=False)
+        for team_id, entries in logs.items():
+            if replace:
+                pipeline.delete(*_logs_keys(team_id))
+            if entries:
+                _append_logs_script(keys=list(_logs_keys(team_id)),
+                                    args=[_compress_log_chunk(entries), logs_max_bytes, logs_max_chunks],
+                                    client=pipeline)
+        pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+
+def _compress_log_chunk(entries):
+    chunk = zlib.compress(json.dumps(entries).encode('utf-8'))
+    while len(chunk) > logs_max_bytes and len(entries) > 1:
+        entries = entries[len(entries) // 2:]
+        chunk = zlib.compress(json.dumps(entries).encode('utf-8'))
+    return chunk
+
+
+def get_logs(team_ids):
+    """
+    Retrieves the stored logs of the applications from the log store in a single pipelined round trip.
+
+    :param team_ids: list. The team IDs of the applications.
+
+    :return: dict. A dictionary mapping the team IDs to lists of log entries ([timestamp, line] pairs, oldest first),
+             an empty list for teams without logs.
+
+    :raises InternalRedisError: If the Redis pipeline fails, encapsulating the original Redis error.
+
+    Note: A chunk which can not be decompressed is logged and skipped.
+    """
+    try:
+        pipeline = redis_logs_db.pipeline(transaction=False)
+        for team_id in team_ids:
+            pipeline.lrange(_logs_keys(team_id)[0], 0, -1)
+        results = pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+    logs = {}
+    for team_id, chunks in zip(team_ids, results):
+        entries = []
+        for chunk in chunks:
+            try:
+                entries.extend(json.loads(zlib.decompress(chunk)))
+            except (zlib.error, ValueError) as e:
+                logging.error(f'Skipping corrupted log chunk of team {team_id}: {str(e)}')
+        logs[team_id] = entries
+    return logs
+
+
+def record_deploy_timings(team_id, timings, window):
+    """
+    Records the phase durations of a deployment in a single pipelined round trip. The durations are stored as JSON
+    in the 'timings' field of the application hash and appended to a rolling window of the latest durations of every
+    phase, from which the percentiles are computed.
+
+    :param team_id: str. The unique identifier of the deployed team.
+    :param timings: dict. A dictionary mapping phase names to durations in seconds.
+    :param window: int. The number of latest durations kept for every phase.
+
+    :raises InternalRedisError: If the Redis pipeline fails, encapsulating the original Redis error.
+    """
+    try:
+        pipeline = redis_db.pipeline(transaction=False)
+        pipeline.hset(team_id, 'timings', json.dumps(timings))
+        for phase, duration in timings.items():
+            pipeline.sadd('deploy_timing_phases', phase)
+            pipeline.lpush(f'deploy_timings:{phase}', duration)
+            pipeline.ltrim(f'deploy_timings:{phase}', 0, window - 1)
+        pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+
+def get_deploy_timings():
+    """
+    Retrieves the rolling windows of the latest phase durations of deployments.
+
+    :return: dict. A dictionary mapping phase names to lists of durations in seconds, newest first.
+
+    :raises InternalRedisError: If a Redis operation fails, encapsulating the original Redis error.
+    """
+    try:
+        phases = sorted(redis_db.smembers('deploy_timing_phases'))
+        pipeline = redis_db.pipeline(transaction=False)
+        for phase in phases:
+            pipeline.lrange(f'deploy_timings:{phase}', 0, -1)
+        windows = pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+    return {phase: [float(duration) for duration in window] for phase, window in zip(phases, windows)}
+
+
 def flush_redis():
     """
     Performs a complete flush of all data stored in Redis, effectively resetting the database to its initial empty state.
@@ -172,5 +481,268 @@ def flush_redis():
         raise InternalRedisError('Redis error: {}'.format(str(e)))
 
 
+def get_registry_auth_fingerprint(registry, username):
+    """
+    Retrieves the fingerprint of the last successfully validated credentials of a user for a registry.
+
+    :param registry: str. The address of the registry.
+    :param username: str. The name of the registry user.
+
+    :return: str or None. The fingerprint of the credentials, or None if no valid credentials are cached.
+
+    :raises InternalRedisError: If the Redis operation fails, encapsulating the original Redis error.
+    """
+    try:
+        return redis_db.get(f'registry_auth:{registry}:{username}')
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+
+def save_registry_auth_fingerprint(registry, username, fingerprint, ttl):
+    """
+    Stores the fingerprint of successfully validated credentials of a user for a registry, so the other workers do
+    not have to validate them again until the fingerprint expires.
+
+    :param registry: str. The address of the registry.
+    :param username: str. The name of the registry user.
+    :param fingerprint: str. A one-way fingerprint of the credentials, never the password itself.
+    :param ttl: float. The time (in seconds) after which the credentials have to be validated again.
+
+    :raises InternalRedisError: If the Redis operation fails, encapsulating the original Redis error.
+    """
+    try:
+        redis_db.set(f'registry_auth:{registry}:{username}', fingerprint, px=int(ttl * 1000))
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+
+# Deletes the lease only if it is still held by the caller, so an expired lease taken over by another worker
+# is never released by the previous holder
+_release_lease_script = redis_db.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+""")
+
+
+# Extends the lease only if it is still held by the caller
+_renew_lease_script = redis_db.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+""")
+
+
+def acquire_lease(key, token, ttl):
+    """
+    Tries to acquire a lease stored under the given key in Redis. The lease is a plain key holding the token of its
+    holder and expires automatically after the given time, so a crashed holder can not block other workers forever.
+
+    :param key: str. The Redis key of the lease.
+    :param token: str. A unique token identifying the holder of the lease.
+    :param ttl: float. The time (in seconds) after which the lease expires.
+
+    :return: bool. True if the lease was acquired; False if it is held by someone else.
+
+    :raises InternalRedisError: If the Redis operation fails, encapsulating the original Redis error.
+    """
+    try:
+        return bool(redis_db.set(key, token, nx=True, px=int(ttl * 1000)))
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+
+def release_lease(key, token):
+    """
+    Releases a lease previously acquired with `acquire_lease`. The lease is only deleted if it is still held by the
+    given token.
+
+    :param key: str. The Redis key of the lease.
+    :param token: str. The token used to acquire the lease.
+
+    :return: bool. True if the lease was released; False if it was not held by the token anymore.
+
+    :raises InternalRedisError: If the Redis operation fails, encapsulating the original Redis error.
+    """
+    try:
+        return bool(_release_lease_script(keys=[key], args=[token]))
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+
+def renew_lease(key, token, ttl):
+    """
+    Renews a lease previously acquired with `acquire_lease`, so it expires the given time from now. The lease is only
+    renewed if it is still held by the given token.
+
+    :param key: str. The Redis key of the lease.
+    :param token: str. The token used to acquire the lease.
+    :param ttl: float. The time (in seconds) after which the lease expires.
+
+    :return: bool. True if the lease was renewed; False if it was not held by the token anymore.
+
+    :raises InternalRedisError: If the Redis operation fails, encapsulating the original Redis error.
+    """
+    try:
+        return bool(_renew_lease_script(keys=[key], args=[token, int(ttl * 1000)]))
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+
+def is_lease_held(key):
+    """
+    Checks whether a lease stored under the given key is currently held by anyone.
+
+    :param key: str. The Redis key of the lease.
+
+    :return: bool. True if the lease is held; False otherwise.
+
+    :raises InternalRedisError: If the Redis operation fails, encapsulating the original Redis error.
+    """
+    try:
+        return bool(redis_db.exists(key))
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+
+def swap_latest_deploy_jobs(latest_jobs, ttl):
+    """
+    Records the latest deploy job of every given team in a single pipelined round trip, returning the deploy jobs
+    they replace.
+
+    :param latest_jobs: dict. A dictionary mapping team IDs to the IDs of their latest deploy jobs.
+    :param ttl: float. The time (in seconds) after which the record of the latest deploy job expires.
+
+    :return: dict. A dictionary mapping team IDs to the IDs of their previously latest deploy jobs, or None.
+
+    :raises InternalRedisError: If the Redis pipeline fails, encapsulating the original Redis error.
+    """
+    team_ids = list(latest_jobs)
+    try:
+        pipeline = redis_db.pipeline(transaction=False)
+        for team_id in team_ids:
+            pipeline.set(f'deploy_latest_job:{team_id}', latest_jobs[team_id], ex=int(ttl), get=True)
+        previous_jobs = pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+    return dict(zip(team_ids, previous_jobs))
+
+
+def get_latest_deploy_job(team_id):
+    """
+    Retrieves the ID of the latest deploy job enqueued for the given team.
+
+    :param team_id: str. The unique identifier of the team.
+
+    :return: str or None. The ID of the latest deploy job, or None if no deploy job was recorded.
+
+    :raises InternalRedisError: If the Redis operation fails, encapsulating the original Redis error.
+    """
+    try:
+        return redis_db.get(f'deploy_latest_job:{team_id}')
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+
+def push_callback_notifications(notifications):
+    """
+    Appends callback notifications to the queue of notifications waiting for delivery by the callback dispatcher.
+
+    :param notifications: list. The notifications as dictionaries serializable to JSON.
+
+    :raises InternalRedisError: If the Redis operation fails, encapsulating the original Redis error.
+    """
+    if not notifications:
+        return
+    try:
+        redis_db.rpush('callback_notifications', *[json.dumps(notification) for notification in notifications])
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+
+def pop_callback_notifications(max_count, timeout):
+    """
+    Takes callback notifications from the queue of notifications waiting for delivery. The call blocks until at least
+    one notification is available or the timeout elapses, and then takes all available notifications up to the given
+    count, so bursts of notifications are delivered together.
+
+    :param max_count: int. The maximum number of notifications taken.
+    :param timeout: float. The maximum time (in seconds) to wait for a notification.
+
+    :return: list. The notifications as dictionaries, in the order they were queued; empty if the timeout elapsed.
+
+    :raises InternalRedisError: If a Redis operation fails, encapsulating the original Redis error.
+    """
+    try:
+        first = redis_db.blpop(['callback_notifications'], timeout=timeout)
+        if not first:
+            return []
+        rest = redis_db.lpop('callback_notifications', max_count - 1) if max_count > 1 else None
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+    return [json.loads(notification) for notification in [first[1]] + (rest or [])]
+
+
+def schedule_callback_retries(notifications, due_times):
+    """
+    Schedules callback notifications whose delivery failed to be delivered again later.
+
+    :param notifications: list. The notifications as dictionaries serializable to JSON, each with a unique 'id'.
+    :param due_times: list. The UNIX timestamps at which the notifications are due, in the order of the notifications.
+
+    :raises InternalRedisError: If the Redis operation fails, encapsulating the original Redis error.
+    """
+    if not notifications:
+        return
+    try:
+        redis_db.zadd('callback_retries', {json.dumps(notification): due_time
+                                           for notification, due_time in zip(notifications, due_times)})
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+
+# Moves the due retries to the queue of notifications atomically, so a retry is never taken by two dispatchers
+_requeue_callback_retries_script = redis_db.register_script("""
+local due = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, notification in ipairs(due) do
+    redis.call('zrem', KEYS[1], notification)
+    redis.call('rpush', KEYS[2], notification)
+end
+return #due
+""")
+
+
+def requeue_due_callback_retries(now, max_count=1000):
+    """
+    Moves the callback notifications whose retry is due back to the queue of notifications waiting for delivery.
+
+    :param now: float. The current UNIX timestamp.
+    :param max_count: int, optional. The maximum number of notifications moved at once.
+
+    :return: int. The number of notifications moved.
+
+    :raises InternalRedisError: If the Redis operation fails, encapsulating the original Redis error.
+    """
+    try:
+        return _requeue_callback_retries_script(keys=['callback_retries', 'callback_notifications'],
+                                                args=[now, max_count])
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+
 class InternalRedisError(Exception):
     pass
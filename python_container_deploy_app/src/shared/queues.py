@@ -0,0 +1,27 @@
+import os
+
+
+# Single-team deployments, whose latency is seen by the teams
+interactive_queue_name = 'interactive'
+# Bulk deployments and operations over all applications, such as the restart of all stopped applications
+bulk_queue_name = 'bulk'
+# Maintenance operations, such as the deletion of all applications
+maintenance_queue_name = 'maintenance'
+# The queue used before the queues were split, drained last so that no enqueued job is lost on upgrade
+legacy_queue_name = 'default'
+
+default_worker_queues = [interactive_queue_name, bulk_queue_name, maintenance_queue_name, legacy_queue_name]
+
+
+def get_worker_queues():
+    """
+    Determines the queues a worker listens on, in the order of their priority, from the 'WORKER_QUEUES' environment
+    variable, which holds a comma separated list of queue names. A worker always takes the next job from the first
+    non-empty queue of the list, so a worker configured with only the interactive queue is reserved for single-team
+    deployments and is never blocked by bulk or maintenance operations.
+
+    :return: list. The names of the queues, from the highest to the lowest priority. Defaults to all queues, with the
+             interactive queue first and the maintenance queue last.
+    """
+    queues = [name.strip() for name in os.environ.get('WORKER_QUEUES', '').split(',') if name.strip()]
+    return queues or default_worker_queues
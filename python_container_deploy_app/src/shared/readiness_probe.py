@@ -0,0 +1,90 @@
+import logging
+import os
+import random
+import time
+
+import requests
+
+
+readiness_probe_enabled = os.environ.get('READINESS_PROBE', 'false').lower() in ['true', '1', 'yes']
+# 'route' probes the application through Traefik, 'container' probes the container directly on the Traefik network
+readiness_probe_target = os.environ.get('READINESS_PROBE_TARGET', 'route')
+readiness_probe_path = os.environ.get('READINESS_PROBE_PATH', '/')
+readiness_probe_port = int(os.environ.get('READINESS_PROBE_PORT', 80))
+traefik_url = os.environ.get('TRAEFIK_URL', 'http://traefik')
+readiness_probe_budget = float(os.environ.get('READINESS_PROBE_BUDGET', 30))
+if readiness_probe_budget <= 0:
+    logging.warning(f'READINESS_PROBE_BUDGET must be positive, using 30 seconds instead of {readiness_probe_budget}')
+    readiness_probe_budget = 30.0
+readiness_probe_timeout = float(os.environ.get('READINESS_PROBE_TIMEOUT', 5))
+initial_backoff = 0.1
+max_backoff = 2.0
+
+probe_session = requests.Session()
+
+
+def probe_readiness(routed_domain, container_name, budget=None):
+    """
+    Checks whether a deployed application is serving HTTP requests. The application is probed with HTTP GET requests
+    either through its Traefik route (by sending the request to Traefik with the routed domain as the Host header) or
+    directly at the container address on the Traefik network, depending on READINESS_PROBE_TARGET. Failed attempts
+    are retried with an exponential backoff with jitter, which also grows with the latency of the failed attempts, until
+    the application responds with a non-error status or the latency budget is exhausted.
+
+    :param routed_domain: str. The domain the application is routed at by Traefik.
+    :param container_name: str. The name of the application container, resolvable on the Traefik network.
+    :param budget: float, optional. The maximum time (in seconds) spent probing, defaults to READINESS_PROBE_BUDGET.
+                   Must be positive.
+
+    :return: dict. The result of the probe with the keys 'ready' (bool), 'time_to_first_200' (seconds from the start
+             of probing to the first successful response, or None), 'probe_latency' (latency in seconds of the last
+             request), 'attempts' (number of requests) and 'last_status' (HTTP status or error of the last request).
+
+    :raises ValueError: If the budget is not positive.
+
+    Note: Redirects are not followed and count as a successful response. A 404 response is treated as not ready, as
+    Traefik responds with 404 until it picks up the route of a new container.
+    """
+    budget = readiness_probe_budget if budget is None else budget
+    if budget <= 0:
+        raise ValueError(f'The readiness probe budget must be positive, got {budget}')
+    if readiness_probe_target == 'container':
+        url, headers = f'http://{container_name}:{readiness_probe_port}{readiness_probe_path}', {}
+    else:
+        url, headers = f'{traefik_url}{readiness_probe_path}', {'Host': routed_domain}
+
+    start = time.monotonic()
+    deadline = start + budget
+    backoff = initial_backoff
+    result = {'ready': False, 'time_to_first_200': None, 'probe_latency': None, 'attempts': 0, 'last_status': None}
+
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        request_start = time.monotonic()
+        result['attempts'] += 1
+        try:
+            response = probe_session.get(url, headers=headers, allow_redirects=False,
+                                         timeout=min(readiness_probe_timeout, remaining))
+            result['last_status'] = response.status_code
+            ready = response.status_code < 400
+        except requests.exceptions.RequestException as e:
+            result['last_status'] = type(e).__name__
+            ready = False
+        latency = time.monotonic() - request_start
+        result['probe_latency'] = latency
+
+        if ready:
+            result['ready'] = True
+            result['time_to_first_200'] = time.monotonic() - start
+            logging.info(f'Application at {routed_domain} is ready after {result["time_to_first_200"]:.3f} seconds')
+            return result
+
+        logging.debug(f'Application at {routed_domain} is not ready yet: {result["last_status"]}')
+        time.sleep(min(backoff * random.uniform(0.5, 1.5), max(0.0, deadline - time.monotonic())))
+        backoff = min(max_backoff, max(backoff * 2, latency))
+
+    logging.info(f'Application at {routed_domain} is not ready after {budget} seconds: {result["last_status"]}')
+    return result
@@ -0,0 +1,57 @@
+import math
+import time
+from contextlib import contextmanager
+
+
+class PhaseTimer:
+    """
+    Measures the durations of the named phases of an operation with a monotonic clock. A phase entered several times
+    accumulates its durations.
+    """
+
+    def __init__(self):
+        self.durations = {}
+        self._start = time.monotonic()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager timing the enclosed block as the given phase. The duration is recorded even if the block
+        raises an exception.
+
+        :param name: str. The name of the phase.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, time.monotonic() - start)
+
+    def record(self, name, duration):
+        """
+        Records a duration measured outside of the timer, e.g. the time a job spent in the queue.
+
+        :param name: str. The name of the phase.
+        :param duration: float. The duration in seconds.
+        """
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+
+    def total(self):
+        """
+        :return: float. The time in seconds since the timer was created.
+        """
+        return time.monotonic() - self._start
+
+
+def percentile(sorted_values, fraction):
+    """
+    Computes a percentile of already sorted values with the nearest-rank method.
+
+    :param sorted_values: list. The values sorted in ascending order.
+    :param fraction: float. The percentile as a fraction between 0 and 1.
+    :return: float or None. The percentile, or None if there are no values.
+    """
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
@@ -1,32 +1,82 @@
-import requests
+import uuid
+from datetime import datetime
+
 import logging
 import rq
 
+from shared.persistance.redis_persistance import push_callback_notifications, InternalRedisError
+
 
-def notify_callback_url(job, *args, **kwargs):
+def notify_callback_url(job, connection, *args, **kwargs):
     """
-    Sends a notification to a specified callback URL with details about a job's execution status and associated application data.
-    It constructs a payload containing the job ID, job status, and application information, then makes a POST request to the callback URL.
+    RQ success callback queueing a notification about the finished job for delivery to the callback URL stored in the
+    job metadata. The notification contains the job ID, the job status and the application data. It is delivered by
+    the callback dispatcher, so the worker returns to processing jobs without waiting for the callback receiver.
 
     :param job: The RQ job instance from which metadata is retrieved, including the callback URL and application data.
-    :param args: Additional arguments (unused in this function, but included for flexibility and future extensions).
+    :param connection: The Redis connection of the job (unused, the notifications are queued in the application db).
+    :param args: The result of the job (unused in this function).
     :param kwargs: Additional keyword arguments (unused in this function, but included for flexibility and future extensions).
 
-    Note: The function logs an error if the POST request to the callback URL fails due to any request-related exception.
-    This ensures that the system is aware of failures in notifying external services or endpoints about the job status.
+    Note: The function logs an error if the notification can not be queued, the job itself is not affected. A deploy
+    job skipped because it was superseded is reported with the 'superseded' status and the ID of the superseding job,
+    like a deploy job cancelled while still queued.
+    """
+    superseded_by = job.meta.get('superseded_by')
+    if superseded_by:
+        _queue_notification(job, 'superseded', superseded_by=superseded_by)
+    else:
+        _queue_notification(job, 'finished')
+
+
+def notify_callback_url_on_failure(job, connection, *exc_info, **kwargs):
+    """
+    RQ failure callback queueing a notification about the failed job for delivery to the callback URL stored in the
+    job metadata. See `notify_callback_url`.
+
+    :param job: The RQ job instance from which metadata is retrieved, including the callback URL and application data.
+    :param connection: The Redis connection of the job (unused, the notifications are queued in the application db).
+    :param exc_info: The type, value and traceback of the exception raised by the job (unused in this function).
+    """
+    _queue_notification(job, 'failed')
+
+
+def _queue_notification(job, status, **details):
+    notification = build_notification(job, status, **details)
+    if notification is None:
+        return
+    try:
+        push_callback_notifications([notification])
+    except InternalRedisError:
+        logging.error("Failed to queue callback to URL: %s", notification['callback_url'])
+
+
+def build_notification(job, status, **details):
+    """
+    Builds the callback notification about a job for the callback URL stored in the job metadata, to be queued with
+    `push_callback_notifications`.
+
+    :param job: The RQ job instance from which metadata is retrieved, including the callback URL and application data.
+    :param status: str. The status of the job reported to the callback URL, e.g. 'finished'.
+    :param details: Additional fields of the payload, e.g. the ID of the job superseding a cancelled job.
+
+    :return: dict or None. The notification, or None if the job has no callback URL.
     """
     callback_url = job.meta.get('callback_url')
-    application = job.meta.get('application', {})
+    if not callback_url:
+        return None
 
-    if callback_url:
-        try:
-            requests.post(callback_url, json={
-                'job_id': job.get_id(),
-                'status': job.get_status(),
-                'application': application,
-            })
-        except requests.exceptions.RequestException as e:
-            logging.error("Failed to send callback to URL: %s", callback_url)
+    return {
+        'id': uuid.uuid4().hex,
+        'callback_url': callback_url,
+        'attempt': 0,
+        'payload': {
+            'job_id': job.get_id(),
+            'status': status,
+            'application': job.meta.get('application', {}),
+            **details,
+        },
+    }
 
 
 def store_data_for_callback(application, status, status_code):
@@ -51,3 +101,49 @@ def store_data_for_callback(application, status, status_code):
         job.meta['status'] = status
         job.meta['status_code'] = status_code
         job.save_meta()
+
+
+def store_progress(**progress):
+    """
+    Stores the progress of a long-running job in the metadata of the current RQ job, so clients polling the job can
+    follow it.
+
+    :param progress: Progress counters of the job, e.g. the total number of items and the number of processed items.
+
+    Note: This function assumes it is called within the context of an RQ worker job and does nothing otherwise.
+    """
+    job = rq.get_current_job()
+    if job:
+        job.meta['progress'] = progress
+        job.save_meta()
+
+
+def store_timings(timings):
+    """
+    Stores the phase durations of the current RQ job in its metadata.
+
+    :param timings: dict. A dictionary mapping phase names to durations in seconds.
+
+    Note: This function assumes it is called within the context of an RQ worker job and does nothing otherwise.
+    """
+    job = rq.get_current_job()
+    if job:
+        job.meta['timings'] = timings
+        job.save_meta()
+
+
+def get_queue_wait():
+    """
+    Computes the time the current RQ job spent waiting in the queue.
+
+    :return: float or None. The time in seconds between enqueueing and starting the job, or None if it is not called
+             within an RQ job.
+
+    Note: RQ records the times as UTC wall clock times of the API and the worker, so unlike the other phase durations
+    the queue wait is not measured with a monotonic clock.
+    """
+    job = rq.get_current_job()
+    if not job or not job.enqueued_at:
+        return None
+    started_at = job.started_at or datetime.utcnow()
+    return max(0.0, (started_at - job.enqueued_at).total_seconds())
@@ -0,0 +1,115 @@
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from shared.persistance.redis_persistance import pop_callback_notifications, schedule_callback_retries, \
+    requeue_due_callback_retries, InternalRedisError
+
+
+callback_concurrency = int(os.environ.get('CALLBACK_CONCURRENCY', 8))
+callback_timeout = float(os.environ.get('CALLBACK_TIMEOUT', 5))
+callback_max_attempts = int(os.environ.get('CALLBACK_MAX_ATTEMPTS', 6))
+callback_retry_backoff = float(os.environ.get('CALLBACK_RETRY_BACKOFF', 1))
+callback_max_retry_backoff = float(os.environ.get('CALLBACK_MAX_RETRY_BACKOFF', 300))
+# Notifications to the same URL sent in a single request as a JSON array, 1 sends every notification on its own
+callback_max_batch = int(os.environ.get('CALLBACK_MAX_BATCH', 1))
+callback_fetch_size = int(os.environ.get('CALLBACK_FETCH_SIZE', 100))
+callback_poll_timeout = float(os.environ.get('CALLBACK_POLL_TIMEOUT', 1))
+
+# Keep-alive connections to the callback receivers shared by all deliveries
+callback_session = requests.Session()
+callback_session.mount('http://', HTTPAdapter(pool_connections=callback_concurrency, pool_maxsize=callback_concurrency))
+callback_session.mount('https://', HTTPAdapter(pool_connections=callback_concurrency, pool_maxsize=callback_concurrency))
+
+
+def run_dispatcher():
+    """
+    Delivers the callback notifications queued by the RQ jobs, until the process is stopped. The notifications are
+    taken from Redis in bursts and grouped by their callback URL, the URLs are then served concurrently by up to
+    CALLBACK_CONCURRENCY threads over pooled keep-alive connections. Failed deliveries are retried with an exponential
+    backoff with jitter, up to CALLBACK_MAX_ATTEMPTS attempts.
+
+    Note: A notification taken from Redis is lost if the dispatcher is killed before delivering it or scheduling its
+    retry. When Redis is not reachable, the dispatcher waits and tries again.
+    """
+    with ThreadPoolExecutor(max_workers=callback_concurrency) as executor:
+        while True:
+            try:
+                requeue_due_callback_retries(time.time())
+                notifications = pop_callback_notifications(callback_fetch_size, callback_poll_timeout)
+            except InternalRedisError:
+                time.sleep(callback_poll_timeout)
+                continue
+
+            by_url = {}
+            for notification in notifications:
+                by_url.setdefault(notification['callback_url'], []).append(notification)
+            # Bounds the number of notifications taken from Redis and not yet delivered
+            list(executor.map(lambda item: deliver_notifications(*item), by_url.items()))
+
+
+def deliver_notifications(callback_url, notifications):
+    """
+    Delivers the notifications to a single callback URL, in the order they were queued. Up to CALLBACK_MAX_BATCH
+    notifications are sent in a single POST request as a JSON array, a single notification is sent as a JSON object.
+    Once a request fails, the failed notifications are scheduled for a retry, and the remaining ones are rescheduled
+    along with them without trying them, so a slow or unreachable receiver costs at most one request timeout. Only the
+    failed notifications count the attempt.
+
+    :param callback_url: str. The URL the notifications are sent to.
+    :param notifications: list. The notifications for the URL.
+
+    :return: int. The number of delivered notifications.
+    """
+    delivered = 0
+    for start in range(0, len(notifications), callback_max_batch):
+        batch = notifications[start:start + callback_max_batch]
+        payloads = [notification['payload'] for notification in batch]
+        try:
+            response = callback_session.post(callback_url, json=payloads if callback_max_batch > 1 else payloads[0],
+                                             timeout=callback_timeout)
+            retryable = response.status_code >= 500 or response.status_code == 429
+            failure = f'status {response.status_code}' if response.status_code >= 400 else None
+        except requests.exceptions.RequestException as e:
+            retryable, failure = True, type(e).__name__
+
+        if failure is None:
+            delivered += len(batch)
+            continue
+
+        if not retryable:
+            logging.error(f"Callback to URL {callback_url} rejected with {failure}, dropping {len(batch)} notifications")
+            continue
+
+        logging.warning(f"Failed to send callback to URL {callback_url}: {failure}")
+        _schedule_retries(batch, notifications[start + len(batch):])
+        break
+    return delivered
+
+
+def _schedule_retries(failed, untried):
+    # The untried notifications keep their attempt count and are due with the failed ones, or right away when all the
+    # failed ones are given up
+    retries = []
+    now = time.time()
+    due_time = now
+    for notification in failed:
+        attempt = notification['attempt'] + 1
+        if attempt >= callback_max_attempts:
+            logging.error(f"Giving up callback to URL {notification['callback_url']} "
+                          f"for job {notification['payload']['job_id']} after {attempt} attempts")
+            continue
+        backoff = min(callback_max_retry_backoff, callback_retry_backoff * 2 ** (attempt - 1))
+        retries.append(dict(notification, attempt=attempt))
+        due_time = max(due_time, now + backoff * random.uniform(0.5, 1.5))
+    retries.extend(untried)
+
+    try:
+        schedule_callback_retries(retries, [due_time] * len(retries))
+    except InternalRedisError:
+        logging.error(f"Failed to schedule the retry of {len(retries)} callbacks")
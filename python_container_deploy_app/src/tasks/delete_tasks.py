@@ -1,8 +1,18 @@
 import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from tasks.callback import store_progress
 from shared.docker_wrapper.docker_delete import delete_container, InternalDockerError
-from shared.persistance.redis_persistance import delete_from_redis, get_all_team_ids, InternalRedisError
+from shared.persistance.redis_persistance import delete_from_redis, delete_many_from_redis, InternalRedisError
 from shared.persistance.redis_persistance import get_application as get_application_from_redis
+from shared.persistance.redis_persistance import get_applications as get_applications_from_redis
+
+
+delete_parallelism = int(os.environ.get('DELETE_PARALLELISM', 8))
+delete_all_timeout = int(os.environ.get('DELETE_ALL_TIMEOUT', 1800))
+progress_report_interval = 1  # seconds between job progress updates
 
 
 def delete_application(team_id, force=False):
@@ -63,40 +73,100 @@ def delete_application(team_id, force=False):
     return None, 200
 
 
-def delete_all_applications(force=False):
+def delete_all_applications(force=False, stop_timeout=None, kill=False):
     """
-    Iteratively deletes all applications listed in the 'managed_applications' set in Redis. It attempts to delete each
-    application's associated container and Redis records. The function can optionally force the deletion of Redis records
-    regardless of container deletion success based on the `force` parameter.
+    Deletes all applications listed in the 'managed_applications' set in Redis. The function is meant to run as a
+    background RQ job: the containers are stopped and removed concurrently by a bounded pool of threads, the progress
+    is reported in the job metadata, and the Redis records of all deleted applications are removed in a single
+    pipelined round trip at the end. The function can optionally force the deletion of Redis records regardless of
+    container deletion success based on the `force` parameter.
 
     :param force: bool, optional. A flag to force deletion of the application records even if the container cannot be
                   deleted (default is False).
+    :param stop_timeout: int, optional. The grace period (in seconds) given to each container to stop before it is
+                         killed (defaults to the CONTAINER_STOP_TIMEOUT environment variable).
+    :param kill: bool, optional. A flag to kill and remove the containers without any grace period (default is False).
 
     :return: Tuple (list, str or None, int). Returns a tuple containing a list of team IDs for which applications were
-             attempted to be deleted, an aggregated error message (or None if all deletions were successful), and an HTTP
+             deleted, an aggregated error message (or None if all deletions were successful), and an HTTP
              status code (200 for success, 500 if any deletions fail).
 
-    :raises InternalRedisError: If an error occurs while accessing or modifying Redis data.
-
-    Note: This function uses `get_all_team_ids` to retrieve all application team IDs and `delete_application` to handle
-    individual application deletions. It accumulates errors, if any, and returns them along with the status of the operation.
+    Note: The number of containers deleted at the same time is limited by the DELETE_PARALLELISM environment variable.
+    Applications listed in the set without any stored data are reported as errors and only removed with `force`.
     """
-    team_ids = get_all_team_ids()
-    deleted = []
+    try:
+        applications = get_applications_from_redis(strict=False)
+    except InternalRedisError as e:
+        return [], str(e), 500
+
+    total = len(applications)
+    done, failed = 0, 0
+    to_delete = []
     errors = []
+    store_progress(total=total, done=done, failed=failed)
+    last_report = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max(1, delete_parallelism)) as executor:
+        futures = {executor.submit(_delete_application_container, application, stop_timeout, kill): application
+                   for application in applications}
+        for future in as_completed(futures):
+            application = futures[future]
+            err = future.result()
+            done += 1
+            if err:
+                failed += 1
+                errors.append(err)
+            if not err or force:
+                to_delete.append(application)
+
+            if time.monotonic() - last_report >= progress_report_interval or done == total:
+                store_progress(total=total, done=done, failed=failed)
+                last_report = time.monotonic()
 
-    # For each team_id, try to delete its associated container
-    for team_id in team_ids:
-        err, status = delete_application(team_id, force=force)
-        if err:
-            errors.append(err)
-        deleted.append(team_id)
+    try:
+        deleted = delete_many_from_redis(to_delete)
+    except InternalRedisError as e:
+        errors.append(str(e))
+        deleted = []
 
     if len(errors) > 0:
         err = f"Failed to delete {len(errors)} applications " \
-              f"out of {len(team_ids)}\n"
+              f"out of {total}\n"
         logging.error(err)
         return deleted, '\n'.join(errors), 500
 
     logging.info(f"Successfully deleted {len(deleted)} applications")
     return deleted, None, 200
+
+
+def _delete_application_container(application, stop_timeout=None, kill=False):
+    """
+    Deletes the container of a single application as a part of the mass deletion.
+
+    :param application: dict. The application data as stored in Redis.
+    :param stop_timeout: int, optional. The grace period (in seconds) given to the container to stop.
+    :param kill: bool, optional. A flag to kill the container without any grace period.
+
+    :return: str or None. An error message if the container could not be deleted; otherwise, None.
+    """
+    team_id = application.get('team_id')
+    status = application.get('status')
+    container_id = application.get('container_id')
+
+    if set(application) == {'team_id'}:
+        return f'No application data for team {team_id}, the state of the db is inconsistent\n'
+    if status != 'running':
+        return None
+    if not container_id:
+        err = f'No container information stored for team {team_id}\n'
+        logging.error(err)
+        return err
+
+    try:
+        delete_container(container_id, stop_timeout=stop_timeout, kill=kill)
+    except InternalDockerError as e:
+        err = f"Failed to delete container {container_id} for team {team_id}\n" \
+              f"Error: {str(e)}\n"
+        logging.error(err)
+        return err
+    return None
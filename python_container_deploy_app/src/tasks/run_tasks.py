@@ -1,26 +1,45 @@
 import logging
 import os
+import threading
+import time
+import uuid
 
-from tasks.callback import store_data_for_callback
+import redis
+import rq
+from rq.job import Job, JobStatus
+
+from tasks.callback import store_data_for_callback, store_timings, get_queue_wait, build_notification
 from shared.docker_wrapper.docker_run import run_container, \
-    InternalDockerError, InvalidParameterError, DockerContainerStartError, UnauthorizedError
+    InternalDockerError, InvalidParameterError, DockerContainerStartError
+from shared.docker_wrapper.docker_utils import UnauthorizedError
 from shared.docker_wrapper.docker_delete import delete_container
+from shared.readiness_probe import probe_readiness, readiness_probe_enabled
+from shared.timing import PhaseTimer
+from shared.metrics import deploy_outcomes
 
 from shared.persistance.redis_persistance import save_to_redis, \
-    is_subdomain_used, InternalRedisError
+    is_subdomain_used, record_deploy_timings, InternalRedisError, redis_queue, append_logs
+from shared.persistance.redis_persistance import acquire_lease, release_lease, renew_lease, swap_latest_deploy_jobs, \
+    get_latest_deploy_job, push_callback_notifications
 from shared.persistance.redis_persistance import get_application as get_application_from_redis
 
 
 traefik_domain = os.environ.get('BASE_DOMAIN', 'localhost')
 traefik_network = os.environ.get('TRAEFIK_NETWORK', 'traefik_default')
 deploy_timeout = int(os.environ.get('DEPLOY_TIMEOUT', 60))
+container_stability_window = float(os.environ.get('CONTAINER_STABILITY_WINDOW', 5))
+deploy_timings_window = int(os.environ.get('DEPLOY_TIMINGS_WINDOW', 1000))
+# The lease is renewed while the deployment runs, so the TTL only bounds how long a dead worker blocks its team
+deploy_lease_ttl = float(os.environ.get('DEPLOY_LEASE_TTL', 60))
+deploy_lease_wait_interval = float(os.environ.get('DEPLOY_LEASE_WAIT_INTERVAL', 0.5))
+deploy_latest_job_ttl = float(os.environ.get('DEPLOY_LATEST_JOB_TTL', 86400))
 
 
 class InternalError(Exception):
     pass
 
 
-def deploy_application(team_id, subdomain, image_name, registry_credentials, redeploy=True):
+def deploy_application(team_id, subdomain, image_name, registry_credentials, redeploy=True, readiness_probe=None):
     """
     Deploys an application by running a Docker container with specified parameters, and handling deployment conditions
     such as redeployment and subdomain availability. Updates application data in Redis upon successful deployment or
@@ -31,6 +50,8 @@ def deploy_application(team_id, subdomain, image_name, registry_credentials, red
     :param image_name: str. Docker image to use for the application container.
     :param registry_credentials: str. Credentials for accessing the Docker registry in 'username:password' format.
     :param redeploy: bool, optional. Flag indicating whether to redeploy the application if it already exists (default is True).
+    :param readiness_probe: bool, optional. Flag indicating whether the deployment succeeds only once the application
+                            responds to HTTP requests (defaults to the READINESS_PROBE environment variable).
 
     :return: Tuple (dict, str or None, int). Returns a tuple containing the application data as a dictionary,
              an error message (or None if successful), and an HTTP status code indicating the outcome.
@@ -39,31 +60,96 @@ def deploy_application(team_id, subdomain, image_name, registry_credentials, red
 
     Note: The deployment logic includes checking deployment conditions, handling Docker and Redis errors,
     and updating Redis with the deployment result. It leverages environment variables for default values like
-    Traefik domain and network, and deploy timeout.
+    Traefik domain and network, and deploy timeout. The duration of every deployment phase is recorded in the job
+    metadata, on the application and in the rolling windows of deploy timings.
+    The deployments of a team are serialized by a Redis lease held for the whole deployment, which a heartbeat thread
+    renews however long the deployment takes. Once the lease is acquired, a job that is no longer the latest deploy
+    job of its team is skipped as superseded, so only the latest deployment requested by the team runs.
     """
+    timer = PhaseTimer()
+    queue_wait = get_queue_wait()
+    if queue_wait is not None:
+        timer.record('queue', queue_wait)
+
+    job = rq.get_current_job()
+    token = job.get_id() if job else uuid.uuid4().hex
+    lease_key = f'deploy_lease:{team_id}'
+    try:
+        with timer.phase('lease'):
+            while not acquire_lease(lease_key, token, deploy_lease_ttl):
+                time.sleep(deploy_lease_wait_interval)
+        superseding_job_id = get_superseding_job_id(team_id, job)
+    except InternalRedisError as e:
+        return None, str(e), 500
+
+    stop_renewal = threading.Event()
+    renewal = threading.Thread(target=_renew_deploy_lease, args=(lease_key, token, stop_renewal), daemon=True)
+    renewal.start()
+    try:
+        if superseding_job_id:
+            err = f'Deployment superseded by job {superseding_job_id}'
+            logging.info(f'{err}, skipping the deployment of team {team_id}')
+            job.meta['superseded_by'] = superseding_job_id
+            store_data_for_callback({"team_id": team_id}, 'superseded', 409)
+            deploy_outcomes.labels('superseded', 409).inc()
+            return None, err, 409
+
+        return _deploy_application(team_id, subdomain, image_name, registry_credentials, redeploy, readiness_probe,
+                                   timer)
+    finally:
+        stop_renewal.set()
+        renewal.join()
+        try:
+            release_lease(lease_key, token)
+        except InternalRedisError:
+            logging.warning(f'Failed to release the deploy lease of team {team_id}, it will expire on its own')
+
+
+def _renew_deploy_lease(lease_key, token, stopped):
+    # Runs in a thread until the deployment ends, so the lease only expires when the worker dies
+    while not stopped.wait(deploy_lease_ttl / 3):
+        try:
+            if not renew_lease(lease_key, token, deploy_lease_ttl):
+                logging.warning(f'Lost the deploy lease {lease_key} before the end of the deployment')
+                return
+        except InternalRedisError:
+            logging.warning(f'Failed to renew the deploy lease {lease_key}, retrying')
+
+
+def _deploy_application(team_id, subdomain, image_name, registry_credentials, redeploy, readiness_probe, timer):
     application = {
         "team_id": team_id,
         "subdomain": subdomain,
         "image_name": image_name
     }
 
+    if readiness_probe is None:
+        readiness_probe = readiness_probe_enabled
+
     container_name = f"team-{team_id}"
     err, status_code = "Failed to assign error cause for this case", 500
     try:
-        check_deploy_conditions(team_id, subdomain, container_name, redeploy)
+        with timer.phase('conditions'):
+            check_deploy_conditions(team_id, subdomain, container_name, redeploy)
 
         logging.debug(f"Deploying application for team {team_id} with subdomain {subdomain} and image {image_name}")
         logging.debug(f"Registry credentials: {registry_credentials}")
 
         container_info = run_container(image_name, subdomain, container_name=f"team-{team_id}",
                                        registry_credentials=registry_credentials, network=traefik_network,
-                                       traefik_domain=traefik_domain, timeout=deploy_timeout)
+                                       traefik_domain=traefik_domain, timeout=deploy_timeout,
+                                       stability_window=container_stability_window, timer=timer)
         application["status"] = container_info[0]
         application["container_id"] = container_info[1]
         application["container_name"] = container_info[2]
         application["route"] = container_info[3]
         application["logs"] = container_info[4]
         application["started_at"] = container_info[5]
+        err, status_code = None, 200
+
+        if readiness_probe:
+            with timer.phase('probe'):
+                err, status_code = check_readiness(application)
 
     except InvalidParameterError as e:
         application["status"] = "invalid_parameter"
@@ -88,15 +174,139 @@ def deploy_application(team_id, subdomain, image_name, registry_credentials, red
     finally:
         status = 'success' if status_code == 200 else err
         store_data_for_callback(application, status, status_code)
+        deploy_outcomes.labels(application.get("status", "unknown"), status_code).inc()
 
     try:
-        save_to_redis(application)
+        with timer.phase('save'):
+            logs = _container_log_entries(application)
+            save_to_redis(application)
+            # The logs of a previous deployment of the team are replaced
+            append_logs({team_id: logs}, replace=True)
     except InternalRedisError as e:
         return None, str(e), 500
 
+    timer.record('total', timer.total())
+    application["timings"] = timer.durations
+    store_timings(timer.durations)
+    try:
+        record_deploy_timings(team_id, timer.durations, deploy_timings_window)
+    except InternalRedisError:
+        logging.error(f"Failed to record deploy timings of team {team_id}")
+
     return application, err, status_code
 
 
+def _container_log_entries(application):
+    # Docker logs have no timestamps, all lines get the time they were read at. The logs later fetched from Loki
+    # continue after that time
+    if application.get("logs") is None:
+        return []
+    timestamp = str(time.time_ns())
+    application["logs_until"] = timestamp
+    application["logs_updated_at"] = time.time()
+    return [[timestamp, line] for line in application["logs"].splitlines()]
+
+
+def get_superseding_job_id(team_id, job):
+    """
+    Checks whether a newer deploy job was enqueued for the team after the given job.
+
+    :param team_id: str. The unique identifier of the team.
+    :param job: rq.job.Job or None. The deploy job being executed, or None outside of an RQ job.
+
+    :return: str or None. The ID of the newer deploy job, or None if the given job is the latest one.
+
+    :raises InternalRedisError: If a Redis operation fails, encapsulating the original Redis error.
+    """
+    if job is None:
+        return None
+
+    latest_job_id = get_latest_deploy_job(team_id)
+    if not latest_job_id or latest_job_id == job.get_id():
+        return None
+    try:
+        # The latest job may not exist if enqueueing it failed after it was recorded
+        if not Job.exists(latest_job_id, connection=redis_queue):
+            return None
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+    return latest_job_id
+
+
+def supersede_deploy_jobs(latest_jobs):
+    """
+    Records the given jobs as the latest deploy jobs of their teams and cancels the previous deploy jobs of the same
+    teams that are still waiting in a queue, so repeated deploy requests of a team are coalesced into the latest one.
+    The cancelled jobs are marked with the ID of the job superseding them, and their callback URLs are notified with the
+    'superseded' status, as RQ does not run the callbacks of cancelled jobs. Previous jobs that were already started
+    are skipped by the worker once it acquires the deploy lease of the team.
+
+    :param latest_jobs: dict. A dictionary mapping team IDs to the IDs of the deploy jobs about to be enqueued.
+
+    :raises InternalRedisError: If a Redis operation fails, encapsulating the original Redis error.
+
+    Note: The function has to be called before the jobs are enqueued, otherwise a worker could pick up a new job
+    before it is recorded as the latest one and skip it.
+    """
+    previous_jobs = swap_latest_deploy_jobs(latest_jobs, deploy_latest_job_ttl)
+    superseded = {job_id: team_id for team_id, job_id in previous_jobs.items()
+                  if job_id and job_id != latest_jobs[team_id]}
+    if not superseded:
+        return
+
+    notifications = []
+    try:
+        for job in Job.fetch_many(list(superseded), connection=redis_queue):
+            if job is None or job.get_status() != JobStatus.QUEUED:
+                continue
+            team_id = superseded[job.get_id()]
+            superseding_job_id = latest_jobs[team_id]
+            logging.info(f'Cancelling deploy job {job.get_id()} superseded by job {superseding_job_id}')
+            job.meta['superseded_by'] = superseding_job_id
+            job.meta['application'] = {"team_id": team_id}
+            job.save_meta()
+            job.cancel()
+            notification = build_notification(job, 'superseded', superseded_by=superseding_job_id)
+            if notification is not None:
+                notifications.append(notification)
+    except redis.exceptions.RedisError as e:
+        logging.error('Redis error: {}'.format(str(e)))
+        raise InternalRedisError('Redis error: {}'.format(str(e)))
+
+    try:
+        push_callback_notifications(notifications)
+    except InternalRedisError:
+        logging.error(f'Failed to queue the callbacks of {len(notifications)} superseded deploy jobs')
+
+
+def check_readiness(application):
+    """
+    Probes a freshly deployed application over HTTP and records the result of the probe on the application. A running
+    container whose application does not respond within the probe budget is kept running, so the team can inspect it,
+    but the deployment is reported as failed.
+
+    :param application: dict. The application data containing the 'route' and 'container_name' keys, updated in place
+                        with the 'readiness', 'time_to_first_200' and 'probe_latency' fields.
+
+    :return: Tuple (str or None, int). An error message (or None if the application is ready) and an HTTP status code.
+    """
+    probe = probe_readiness(application["route"], application["container_name"])
+    application["readiness"] = "ready" if probe["ready"] else "not_ready"
+    # Redis can not store None values
+    if probe["probe_latency"] is not None:
+        application["probe_latency"] = probe["probe_latency"]
+    if probe["ready"]:
+        application["time_to_first_200"] = probe["time_to_first_200"]
+        return None, 200
+
+    err = f'Application at {application["route"]} did not respond after {probe["attempts"]} attempts, ' \
+          f'last status: {probe["last_status"]}'
+    logging.error(err)
+    application["error"] = err
+    return err, 400
+
+
 def check_deploy_conditions(team_id, subdomain, container_name, redeploy=True):
     """
     Checks conditions for deploying an application, such as verifying if the application or subdomain already exists,
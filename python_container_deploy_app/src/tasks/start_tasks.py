@@ -1,35 +1,47 @@
 import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from shared.docker_wrapper.docker_start import InternalDockerError, InvalidParameterError, start_container
-from shared.persistance.redis_persistance import save_to_redis, InternalRedisError
+from shared.docker_wrapper.docker_start import InternalDockerError, InvalidParameterError, start_container, \
+    list_containers
+from shared.persistance.redis_persistance import update_fields_in_redis, InternalRedisError
 from shared.persistance.redis_persistance import get_applications as get_applications_from_redis
 
 
+resume_parallelism = int(os.environ.get('RESUME_PARALLELISM', 8))
+
+
 def resume_stopped_containers():
     """
-    Attempts to resume all stopped Docker containers for applications stored in Redis. This function iterates through
-    all applications, checks their status, and starts their associated containers if they are not already running.
-    Updates the application status and start time in Redis upon successful container start.
-
-    :return: Tuple (None or str, int). If an error occurs while accessing Redis or starting a container,
-             returns a tuple containing an error message and a 500 status code. If all containers are processed
-             successfully, returns None and a 500 status code only if the final Redis save fails for any application.
+    Attempts to resume all stopped Docker containers for applications stored in Redis. All containers on the host are
+    listed with a single Docker API call, the stopped containers of the applications are started concurrently by a
+    bounded pool of threads, and only the application status and start time are written back to Redis in a single
+    pipeline, so changes made to the applications in the meantime are not overwritten.
 
-    :raises InternalRedisError: If an error occurs while accessing or modifying Redis data.
-    :raises InvalidParameterError: If the container ID provided to `start_container` is invalid.
-    :raises InternalDockerError: If a Docker operation fails during container start.
+    :return: Tuple (dict or None, str or None, int). Returns a tuple containing a report with the time (in seconds)
+             it took to start the container of every resumed team under 'timings' and the error of every team whose
+             container failed to start under 'failures', an aggregated error message (or None if all containers were
+             resumed), and an HTTP status code (200 for success, 500 if any container failed to start or if an error
+             occurs while accessing Redis or Docker).
 
-    Note: The function leverages `get_applications_from_redis` to fetch application data, `start_container` to resume
-    containers, and `save_to_redis` to update application status in Redis. It logs the status of each operation, providing
-    detailed feedback on the process and handling errors appropriately.
+    Note: The number of containers started at the same time is limited by the RESUME_PARALLELISM environment variable.
+    The function leverages `get_applications_from_redis` to fetch application data, `list_containers` and
+    `start_container` to resume containers, and `update_fields_in_redis` to update application status in Redis.
     """
     try:
         applications = get_applications_from_redis()
         logging.info(f"Found {len(applications)} applications")
     except InternalRedisError as e:
-        return str(e), 500
+        return None, str(e), 500
+
+    try:
+        container_statuses = list_containers()
+    except InternalDockerError as e:
+        return None, str(e), 500
+
+    to_resume = []
     for application in applications:
-        logging.info(f"Resuming application {application}")
         team_id = application.get('team_id')
         container_id = application.get('container_id')
         status = application.get('status')
@@ -39,26 +51,65 @@ def resume_stopped_containers():
         elif not container_id:
             logging.info(f"Container for team {team_id} was not running, but status was {status}, skipping")
             continue
+        to_resume.append(application)
+
+    timings = {}
+    failures = {}
+    updates = {}
+    with ThreadPoolExecutor(max_workers=max(1, resume_parallelism)) as executor:
+        results = executor.map(lambda application: _resume_application(application, container_statuses), to_resume)
+        for application, (fields, duration, err) in zip(to_resume, results):
+            team_id = application['team_id']
+            updates[team_id] = fields
+            timings[team_id] = duration
+            if err:
+                failures[team_id] = err
+
+    report = {'timings': timings, 'failures': failures}
+    try:
+        update_fields_in_redis(updates)
+    except InternalRedisError as e:
+        logging.error("Failed to save resumed applications to redis")
+        return report, str(e), 500
+
+    if failures:
+        err = f"Failed to resume {len(failures)} applications out of {len(to_resume)}\n"
+        logging.error(err)
+        return report, err, 500
+
+    logging.info(f"Successfully resumed {len(to_resume)} applications")
+    return report, None, 200
+
+
+def _resume_application(application, container_statuses):
+    """
+    Starts the container of a single application and computes the resulting changes of the application.
+
+    :param application: dict. The application data as stored in Redis.
+    :param container_statuses: dict. The statuses of all containers on the host, as returned by `list_containers`.
+
+    :return: Tuple (dict, float, str or None). The changed fields of the application (its status and, if the container
+             was started, its start time), the time (in seconds) it took to start the container, and an error message
+             if the container could not be started.
+    """
+    team_id = application.get('team_id')
+    container_id = application.get('container_id')
+    started = time.monotonic()
+    fields = {}
+    err = None
+
+    try:
+        if container_id not in container_statuses:
+            raise InvalidParameterError(f'Container {container_id} not found')
+        started_at, _ = start_container(container_id, status=container_statuses[container_id])
+        logging.info(f"Successfully started container {container_id} for team {team_id}")
+        fields["status"] = "running"
+        if started_at:
+            fields["started_at"] = started_at
+    except (InvalidParameterError, InternalDockerError) as e:
+        err = f"Failed to start container {container_id} for team {team_id}\n" \
+              f"Error: {str(e)}\n"
+        logging.error(err)
+        fields["status"] = "internal_error"
 
-        try:
-            started_at, _ = start_container(container_id)
-            logging.info(f"Successfully started container {container_id} for team {team_id}")
-            application["status"] = "running"
-            if started_at:
-                application["started_at"] = started_at
-        except InvalidParameterError as e:
-            err = f"Failed to start container {container_id} for team {team_id}\n" \
-                  f"Error: {str(e)}\n"
-            logging.error(err)
-            application["status"] = "internal_error"
-        except InternalDockerError as e:
-            err = f"Failed to start container {container_id} for team {team_id}\n" \
-                  f"Error: {str(e)}\n"
-            logging.error(err)
-            application["status"] = "internal_error"
-
-        try:
-            save_to_redis(application)
-        except InternalRedisError as e:
-            logging.error(f"Failed to save application {application} to redis")
-            return None, str(e), 500
+    return fields, time.monotonic() - started, err
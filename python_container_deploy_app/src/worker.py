@@ -1,10 +1,11 @@
 import logging
+import shutil
 
 import redis
 import os
-from rq import Worker
 
 from shared.utils import get_log_level
+from shared.queues import get_worker_queues
 
 
 logging.basicConfig(level=get_log_level())
@@ -12,7 +13,23 @@ logging.basicConfig(level=get_log_level())
 redis_host = os.getenv('REDIS_HOST', 'redis-db')
 redis_port = int(os.getenv('REDIS_PORT', 6379))
 rq_db_id = int(os.getenv('RQ_DB', 1))
+metrics_port = int(os.getenv('METRICS_PORT', 9100))
+
+# The metrics of the previous run of the worker are discarded before any metric is created
+multiprocess_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+if multiprocess_dir:
+    shutil.rmtree(multiprocess_dir, ignore_errors=True)
+    os.makedirs(multiprocess_dir)
+else:
+    logging.warning('PROMETHEUS_MULTIPROC_DIR is not set, the metrics of the jobs will not be exposed')
+
+from prometheus_client import start_http_server  # noqa: E402
+from shared.metrics import MetricsWorker, build_registry  # noqa: E402
+
+start_http_server(metrics_port, registry=build_registry())
 
 redis_queue = redis.Redis(host='redis-db', port=redis_port, db=rq_db_id, charset="utf-8")
-w = Worker('default', connection=redis_queue)
+worker_queues = get_worker_queues()
+logging.info(f'Listening on queues in the order of priority: {", ".join(worker_queues)}')
+w = MetricsWorker(worker_queues, connection=redis_queue)
 w.work()
@@ -0,0 +1,72 @@
+"""
+Microbenchmark of the application listing read path of the deploy API.
+
+Fills a scratch Redis database with N synthetic applications and measures the latency and the number of Redis round
+trips of `redis_persistance.get_applications` for every N. The number of round trips is expected to stay constant as
+N grows.
+
+Usage:
+    REDIS_HOST=localhost python benchmarks/bench_get_applications.py --sizes 10 100 1000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'python_container_deploy_app', 'src'))
+
+from shared.persistance import redis_persistance  # noqa: E402
+from round_trips import RoundTripCounter  # noqa: E402
+
+
+def populate(redis_db, size):
+    redis_db.flushdb()
+    pipeline = redis_db.pipeline()
+    for i in range(size):
+        team_id = f'bench-{i}'
+        pipeline.sadd('managed_applications', team_id)
+        pipeline.sadd('used_subdomains', team_id)
+        pipeline.hset(team_id, mapping={
+            'team_id': team_id,
+            'subdomain': team_id,
+            'image_name': 'traefik/whoami',
+            'status': 'running',
+            'container_id': f'{i:064x}',
+            'container_name': f'team-{team_id}',
+            'route': f'{team_id}.app.localhost',
+            'started_at': int(time.time()),
+        })
+    pipeline.execute()
+
+
+def run(sizes, repeat):
+    redis_db = redis.Redis(host=os.getenv('REDIS_HOST', 'localhost'), port=int(os.getenv('REDIS_PORT', 6379)),
+                           db=int(os.getenv('BENCH_REDIS_DB', 15)), decode_responses=True)
+    redis_persistance.redis_db = redis_db
+
+    print(f"{'applications':>12} {'round trips':>12} {'median ms':>10} {'p95 ms':>10}")
+    for size in sizes:
+        populate(redis_db, size)
+        durations = []
+        with RoundTripCounter() as counter:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                applications = redis_persistance.get_applications()
+                durations.append((time.perf_counter() - start) * 1000)
+        assert len(applications) == size
+        durations.sort()
+        p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+        print(f"{size:>12} {counter.count // repeat:>12} {statistics.median(durations):>10.2f} {p95:>10.2f}")
+    redis_db.flushdb()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the application listing read path.")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[10, 100, 1000], help="Numbers of applications.")
+    parser.add_argument("--repeat", type=int, default=20, help="Number of measured calls per size.")
+    args = parser.parse_args()
+
+    run(args.sizes, args.repeat)
@@ -0,0 +1,83 @@
+"""
+Microbenchmark of the team listing read path of the ghost API.
+
+Fills a scratch Redis database with N synthetic teams and measures the latency and the number of Redis round trips of
+`persistance.get_team_data_from_db` for every N, next to the previous read path (KEYS followed by three HGETs per
+team) as a baseline.
+
+Usage:
+    REDIS_HOST=localhost python benchmarks/bench_ghost_api_teams.py --sizes 1000 10000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'ghost_api'))
+
+import persistance  # noqa: E402
+from round_trips import RoundTripCounter  # noqa: E402
+
+
+def keys_and_hgets(redis_db):
+    # The read path before SCAN and HMGET, kept as the baseline
+    team_data = []
+    for team_id in redis_db.keys():
+        url = redis_db.hget(team_id, 'url')
+        hash_value = redis_db.hget(team_id, 'hash')
+        team_name = redis_db.hget(team_id, 'team_name')
+        team_data.append((url, team_id, hash_value, team_name))
+    return team_data
+
+
+def populate(redis_db, size):
+    redis_db.flushdb()
+    pipeline = redis_db.pipeline()
+    for i in range(size):
+        team_id = f'{i:08x}-bench'
+        pipeline.hset(team_id, mapping={
+            'url': f'https://tourde.app/team/{team_id}',
+            'hash': f'{i:032x}',
+            'team_name': f'Bench team {i}',
+        })
+    pipeline.execute()
+
+
+def measure(read, size, repeat):
+    durations = []
+    with RoundTripCounter() as counter:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            team_data = read()
+            durations.append((time.perf_counter() - start) * 1000)
+    assert len(team_data) == size
+    durations.sort()
+    p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+    return counter.count // repeat, statistics.median(durations), p95
+
+
+def run(sizes, repeat):
+    redis_db = redis.Redis(host=os.getenv('REDIS_HOST', 'localhost'), port=int(os.getenv('REDIS_PORT', 6379)),
+                           db=int(os.getenv('BENCH_REDIS_DB', 15)), decode_responses=True)
+    persistance.redis_db = redis_db
+
+    print(f"{'read path':>16} {'teams':>8} {'round trips':>12} {'median ms':>10} {'p95 ms':>10}")
+    for size in sizes:
+        populate(redis_db, size)
+        for name, read in (('keys + hget', lambda: keys_and_hgets(redis_db)),
+                           ('scan + hmget', persistance.get_team_data_from_db)):
+            round_trips, median, p95 = measure(read, size, repeat)
+            print(f"{name:>16} {size:>8} {round_trips:>12} {median:>10.2f} {p95:>10.2f}")
+    redis_db.flushdb()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the team listing read path of the ghost API.")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[1000, 10000], help="Numbers of teams.")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of measured calls per size.")
+    args = parser.parse_args()
+
+    run(args.sizes, args.repeat)
@@ -0,0 +1,28 @@
+"""
+Helpers shared by the Redis benchmarks.
+"""
+import redis
+
+
+class RoundTripCounter:
+    """
+    Counts the round trips made through a Redis client by wrapping the method that writes packed commands to the
+    connection. A single command and a whole pipeline are both sent with one call.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._original = redis.connection.Connection.send_packed_command
+
+    def __enter__(self):
+        counter = self
+
+        def send_packed_command(connection, command, check_health=True):
+            counter.count += 1
+            return counter._original(connection, command, check_health)
+
+        redis.connection.Connection.send_packed_command = send_packed_command
+        return self
+
+    def __exit__(self, *exc_info):
+        redis.connection.Connection.send_packed_command = self._original
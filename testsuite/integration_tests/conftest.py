@@ -380,8 +380,19 @@ def initial_cleanup(domain_name, credentials):
 
     response = requests.delete(url, auth=auth, params=params)
 
-    if response.status_code not in [200]:  # 200 OK
+    if response.status_code not in [202]:  # 202 Accepted
         pytest.fail(f"Initial cleanup failed with status code {response.status_code}")
 
+    # The deletion runs as a background job, wait for it to finish
+    job_url = f'https://deploy.{domain_name}/job/{response.json()["job_id"]}'
+
+    @backoff.on_predicate(backoff.constant, lambda status: status not in ['finished', 'failed'],
+                          interval=2, max_tries=150)
+    def wait_for_job():
+        return requests.get(job_url, auth=auth).json()['status']
+
+    if wait_for_job() != 'finished':
+        pytest.fail("Initial cleanup job did not finish")
+
     yield
 
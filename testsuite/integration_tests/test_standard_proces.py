@@ -127,4 +127,48 @@ def test_get_all_applications(initial_cleanup, domain_name, credentials, deploy_
         assert 'subdomain' in app
         assert 'image_name' in app
         assert 'started_at' in app
-        assert 'logs' in app
+        # The logs are only listed when requested
+        assert 'logs' not in app
+
+
+def test_get_all_applications_with_logs(initial_cleanup, domain_name, credentials, deploy_four_applications):
+    """
+    Tests the retrieval of the logs of all deployed applications with a field projection.
+    """
+    url = f'https://deploy.{domain_name}/application'
+    auth = HTTPBasicAuth(credentials[0], credentials[1])
+
+    response = requests.get(url, params={'fields': 'logs'}, auth=auth)
+
+    assert response.status_code == 200
+
+    data = response.json()
+
+    assert len(data) == 4
+    for app in data:
+        assert set(app) == {'team_id', 'logs'}
+
+
+def test_bulk_deploy_applications(domain_name, credentials, blame, backoff_function, cleanup_function, request):
+    """
+    Tests the deployment of multiple applications with a single request.
+    The test submits two valid deploy specifications and an invalid one, verifies that only the valid ones are
+    enqueued, and waits for both applications to start.
+    """
+    url = f'https://deploy.{domain_name}/applications'
+    auth = HTTPBasicAuth(credentials[0], credentials[1])
+    team_ids = [f'{blame()}-bulk-{i}' for i in range(2)]
+    specs = [{'team_id': team_id, 'subdomain': f'public-hash-{team_id}'} for team_id in team_ids]
+    specs.append({'subdomain': 'missing-team-id'})
+
+    response = requests.post(url, auth=auth, json=specs)
+
+    assert response.status_code == 202
+    results = response.json()['results']
+    assert len(results) == 3
+    assert all('job_id' in result for result in results[:2])
+    assert 'error' in results[2] and 'job_id' not in results[2]
+
+    for team_id in team_ids:
+        request.addfinalizer(cleanup_function(f'https://deploy.{domain_name}/application/{team_id}', team_id))
+        backoff_function(f'public-hash-{team_id}', team_id, 10, 10)